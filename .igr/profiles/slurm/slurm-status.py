@@ -5,13 +5,43 @@ import shlex
 import sys
 import time
 import logging
+
+from slurm_utils import (ArraySpool, LocalPool, StatusStore, is_terminal,
+                         load_settings, record_failure)
 logger = logging.getLogger("__name__")
 
 STATUS_ATTEMPTS = 20
 
-jobid = sys.argv[1]
+jobid = snakemake_jobid = sys.argv[1]
+settings = load_settings()
+
+# Jobs run on the submit host have no slurm state
+if jobid.startswith("local:"):
+    print(LocalPool(settings).status(jobid))
+    exit(0)
+
+# Jobs spooled into a job array answer for their own array task
+if jobid.startswith("array:"):
+    jobid = ArraySpool(settings).resolve(jobid)
+    if jobid is None:
+        print("running")
+        exit(0)
+    elif jobid == "failed":
+        print("failed")
+        exit(0)
 
-for i in range(STATUS_ATTEMPTS):
+status = None
+submitted = False
+if settings.get("status_cache", False):
+    # One sacct call per polling interval for every job in the workflow
+    store = StatusStore(interval=settings.get("status_poll_interval", 30))
+    status = store.state(jobid)
+    # Freshly submitted jobs may not be known to sacct yet
+    submitted = status == "SUBMITTED"
+    if submitted:
+        status = None
+
+for i in range(STATUS_ATTEMPTS if status is None else 0):
     try:
         sacct_res = sp.check_output(shlex.split("sacct -P -b -j {} -n".format(jobid)))
         res = {x.split("|")[0]: x.split("|")[1] for x in sacct_res.decode().strip().split("\n")}
@@ -36,7 +66,12 @@ for i in range(STATUS_ATTEMPTS):
         else:
             time.sleep(1)
 
-status = res[jobid]
+if status is None:
+    status = res.get(jobid, "PENDING") if submitted else res[jobid]
+
+# Keep the failure reason for the resource callables of the next attempt
+if is_terminal(status) and status != "COMPLETED":
+    record_failure(snakemake_jobid, jobid, status)
 
 if (status == "BOOT_FAIL"):
     print("failed")
@@ -6,6 +6,8 @@ import math
 import argparse
 import subprocess
 from snakemake.utils import read_job_properties
+from slurm_utils import (ArraySpool, LocalPool, SinfoCache, StatusStore,
+                         job_key, load_settings, remember_job)
 
 
 ##############################
@@ -142,8 +144,7 @@ slurm_parser.add_argument(
     "-o", "--output", help="file for batch script's standard output",
     default="slurm_output" if "slurm_output" else None)
 slurm_parser.add_argument(
-    "-p", "--partition", help="partition requested",
-    default=_get_default_partition(), type=str)
+    "-p", "--partition", help="partition requested", type=str)
 slurm_parser.add_argument(
     "-q", "--qos", help="quality of service")
 slurm_parser.add_argument(
@@ -156,6 +157,9 @@ slurm_parser.add_argument(
     "-C", "--constraint", help="specify a list of constraints")
 slurm_parser.add_argument(
     "--mem", help="minimum amount of real memory")
+parser.add_argument(
+    "--refresh-sinfo", help="Ignore cached sinfo answers and query again",
+    action="store_true")
 
 opt_keys = ["array", "account", "begin", "cpus_per_task",
             "dependency", "workdir", "error", "job_name", "mail_type",
@@ -216,12 +220,23 @@ if "threads" in job_properties:
 cluster_config = job_properties.get("cluster", {})
 arg_dict.update(job_properties.get("cluster", {}))
 
+# Partition and node descriptions rarely change: reuse them across
+# submissions instead of calling sinfo for every job
+settings = load_settings()
+sinfo = SinfoCache(ttl=settings.get("sinfo_cache_ttl", 86400),
+                   refresh=args.refresh_sinfo)
+if arg_dict["partition"] is None:
+    arg_dict["partition"] = sinfo.get("default_partition",
+                                      _get_default_partition)
+
 # Determine partition with features. If no constraints have been set,
 # select the partition with lowest memory
 try:
     part = arg_dict["partition"]
-    config = _get_cluster_configuration(part)
-    mem_feat = _get_features_and_memory(part)
+    config = sinfo.get("configuration:{}".format(part),
+                       lambda: _get_cluster_configuration(part))
+    mem_feat = sinfo.get("features:{}".format(part),
+                         lambda: _get_features_and_memory(part))
     MEMORY_PER_PARTITION = _get_available_memory(mem_feat,
                                                  arg_dict["constraint"])
     MEMORY_PER_CPU = MEMORY_PER_PARTITION / int(config["cpus"])
@@ -262,6 +277,26 @@ for k, v in arg_dict.items():
     if v is not None:
         opts += " --{} \"{}\" ".format(k.replace("_", "-"), v)
 
+rule = job_properties.get("rule")
+
+# Jobs predicted to be short skip the queue and run on the submit host
+if arg_dict["wrap"] is None:
+    local = LocalPool(settings).add(
+        job_properties, arg_dict["time"], arg_dict["mem"], jobscript,
+        job_key(rule or "", job_properties.get("wildcards", {}))
+    )
+    if local is not None:
+        remember_job(local, job_properties)
+        print(local)
+        sys.exit(0)
+
+# Sibling jobs of array-friendly rules are grouped into one job array
+if arg_dict["wrap"] is None and rule in settings.get("array_rules", []):
+    placeholder = ArraySpool(settings).add(rule, opts, jobscript)
+    remember_job(placeholder, job_properties)
+    print(placeholder)
+    sys.exit(0)
+
 if arg_dict["wrap"] is not None:
     cmd = "sbatch {opts}".format(opts=opts)
 else:
@@ -281,3 +316,10 @@ try:
 except Exception as e:
     print(e)
     raise
+
+# Let the status cache know about this job before its first status check
+if settings.get("status_cache", False):
+    StatusStore().register(jobid)
+
+# Failures of this job will be reported for its rule and wildcards
+remember_job(jobid, job_properties)
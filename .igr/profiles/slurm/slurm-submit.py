@@ -6,6 +6,8 @@ import argparse
 import subprocess
 
 from snakemake.utils import read_job_properties
+from slurm_utils import (ArraySpool, LocalPool, StatusStore, job_key,
+                         load_settings, remember_job)
 
 parser = argparse.ArgumentParser(add_help=False)
 parser.add_argument(
@@ -133,6 +135,27 @@ for k, v in arg_dict.items():
     if v is not None:
         opts += " --{} \"{}\" ".format(k.replace("_", "-"), v)
 
+settings = load_settings()
+rule = job_properties.get("rule")
+
+# Jobs predicted to be short skip the queue and run on the submit host
+if arg_dict["wrap"] is None:
+    local = LocalPool(settings).add(
+        job_properties, arg_dict["time"], arg_dict["mem"], jobscript,
+        job_key(rule or "", job_properties.get("wildcards", {}))
+    )
+    if local is not None:
+        remember_job(local, job_properties)
+        print(local)
+        sys.exit(0)
+
+# Sibling jobs of array-friendly rules are grouped into one job array
+if arg_dict["wrap"] is None and rule in settings.get("array_rules", []):
+    placeholder = ArraySpool(settings).add(rule, opts, jobscript)
+    remember_job(placeholder, job_properties)
+    print(placeholder)
+    sys.exit(0)
+
 if arg_dict["wrap"] is not None:
     cmd = "sbatch {opts}".format(opts=opts)
 else:
@@ -152,3 +175,10 @@ try:
 except Exception as e:
     print(e)
     raise
+
+# Let the status cache know about this job before its first status check
+if settings.get("status_cache", False):
+    StatusStore().register(jobid)
+
+# Failures of this job will be reported for its rule and wildcards
+remember_job(jobid, job_properties)
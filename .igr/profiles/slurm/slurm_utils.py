@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the slurm profile scripts (submission and status)
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess as sp
+import time
+from contextlib import contextmanager
+
+PROFILE_DIR = os.path.dirname(os.path.abspath(__file__))
+SETTINGS = os.path.join(PROFILE_DIR, "settings.json")
+STATUS_STORE = os.path.join(".snakemake", "slurm-status", "status.json")
+ARRAY_SPOOL = os.path.join(".snakemake", "slurm-array")
+JOB_LEDGER = os.path.join(".snakemake", "slurm-jobs.json")
+LOCAL_POOL = os.path.join(".snakemake", "slurm-local")
+# Read by the pipeline resource callables (rules/common.smk)
+FAILURE_LEDGER = os.path.join(".snakemake", "slurm-failures.json")
+SINFO_CACHE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "cel-cnv-eacon", "sinfo.json"
+)
+
+# Slurm states after which a job will never change again
+TERMINAL_STATES = ("BOOT_FAIL", "CANCELLED", "COMPLETED", "DEADLINE",
+                   "FAILED", "NODE_FAIL", "OUT_OF_MEMORY", "PREEMPTED",
+                   "TIMEOUT")
+
+
+def load_settings():
+    """Load the profile settings, or an empty mapping"""
+    try:
+        with open(SETTINGS) as settings:
+            return json.load(settings)
+    except (OSError, ValueError):
+        return {}
+
+
+def is_terminal(state):
+    """Return True if a slurm state is final"""
+    return state.split(" ")[0] in TERMINAL_STATES
+
+
+@contextmanager
+def locked(path):
+    """Hold an exclusive lock on a sidecar file of the given path"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_json(path, default):
+    """Read a json file, returning default if it is missing or broken"""
+    try:
+        with open(path) as stream:
+            return json.load(stream)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path, content):
+    """Atomically replace a json file"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "w") as stream:
+        json.dump(content, stream)
+    os.replace(tmp, path)
+
+
+def expand_array_ids(jobid):
+    """
+    Expand the collapsed notation sacct uses for pending array tasks,
+    e.g. 123_[0-2,5] into 123_0, 123_1, 123_2 and 123_5
+    """
+    m = re.match(r"^(\d+)_\[([\d,\-]+)(%\d+)?\]$", jobid)
+    if m is None:
+        return [jobid]
+    tasks = []
+    for chunk in m.group(2).split(","):
+        first, _, last = chunk.partition("-")
+        for task in range(int(first), int(last or first) + 1):
+            tasks.append("{}_{}".format(m.group(1), task))
+    return tasks
+
+
+def sacct_states(jobids):
+    """Query the states of several jobs with a single sacct call"""
+    cmd = "sacct -P -b -n -j {}".format(",".join(jobids))
+    res = sp.check_output(shlex.split(cmd))
+    states = {}
+    for line in res.decode().strip().split("\n"):
+        fields = line.split("|")
+        if len(fields) < 2:
+            continue
+        # Job steps (123.batch, 123.extern) are not what Snakemake waits for
+        for job in expand_array_ids(fields[0]):
+            if job in jobids:
+                states[job] = fields[1]
+    return states
+
+
+def parse_memory_mb(value):
+    """
+    Convert a sacct memory field (e.g. 123456K, 4Gn, 4096Mc) to MB,
+    or return None if it is empty
+    """
+    m = re.match(r"^([\d.]+)([KMGT]?)[nc]?$", value or "")
+    if m is None:
+        return None
+    factor = {"K": 1 / 1024, "": 1 / 1024 ** 2, "M": 1, "G": 1024,
+              "T": 1024 ** 2}[m.group(2)]
+    return float(m.group(1)) * factor
+
+
+def parse_duration_min(value):
+    """
+    Convert a sacct duration field ([D-][HH:]MM:SS) to minutes, or return
+    None if it is empty or unlimited
+    """
+    m = re.match(r"^(?:(\d+)-)?(?:(\d+):)?(\d+):(\d+)$", value or "")
+    if m is None:
+        return None
+    days, hours, minutes, seconds = (int(g or 0) for g in m.groups())
+    return days * 1440 + hours * 60 + minutes + seconds / 60
+
+
+def job_usage(jobid):
+    """
+    Return the state, peak memory, elapsed time, requested memory and
+    time limit of a finished job
+    """
+    cmd = ("sacct -P -n -j {} "
+           "-o JobID,State,MaxRSS,Elapsed,ReqMem,Timelimit".format(jobid))
+    res = sp.check_output(shlex.split(cmd))
+    usage = {"max_rss_mb": None}
+    for line in res.decode().strip().split("\n"):
+        fields = line.split("|")
+        if len(fields) < 6:
+            continue
+        job, state, max_rss, elapsed, req_mem, timelimit = fields[:6]
+        if job == jobid:
+            usage.update({
+                "state": state.split(" ")[0],
+                "elapsed_min": parse_duration_min(elapsed),
+                "req_mem_mb": parse_memory_mb(req_mem),
+                "timelimit_min": parse_duration_min(timelimit)
+            })
+        # Peak memory is only measured on job steps (123.batch, ...)
+        rss = parse_memory_mb(max_rss)
+        if rss is not None:
+            usage["max_rss_mb"] = max(usage["max_rss_mb"] or 0, rss)
+    return usage
+
+
+def job_key(rule, wildcards):
+    """
+    Identify a job across attempts by its rule and wildcards
+    """
+    return "{}:{}".format(rule, ",".join(
+        "{}={}".format(name, value) for name, value in sorted(wildcards.items())
+    ))
+
+
+def remember_job(jobid, job_properties):
+    """Record which rule and wildcards a submitted job runs"""
+    with locked(JOB_LEDGER):
+        jobs = read_json(JOB_LEDGER, {})
+        jobs[jobid] = job_key(
+            job_properties.get("rule", ""),
+            job_properties.get("wildcards", {})
+        )
+        write_json(JOB_LEDGER, jobs)
+
+
+def record_failure(jobid, slurm_jobid, state):
+    """
+    Save why a job failed, with its measured peak memory and elapsed
+    time, so that the next attempt only raises the exhausted resource
+    """
+    key = read_json(JOB_LEDGER, {}).get(jobid)
+    if key is None:
+        return
+    try:
+        usage = job_usage(slurm_jobid)
+    except sp.CalledProcessError:
+        usage = {}
+    usage.update({
+        "state": state.split(" ")[0],
+        "jobid": slurm_jobid,
+        "recorded": time.time()
+    })
+    with locked(FAILURE_LEDGER):
+        failures = read_json(FAILURE_LEDGER, {})
+        failures[key] = usage
+        write_json(FAILURE_LEDGER, failures)
+
+
+class StatusStore:
+    """
+    Local cache of slurm job states, shared by all status checks.
+
+    Jobs are registered at submission time with the SUBMITTED
+    placeholder state, until sacct knows about them. Whenever the cache is older
+    than the polling interval, the first status check to notice it takes
+    the lock and refreshes every unfinished job with one sacct call; all
+    other checks are answered from the cache.
+    """
+    def __init__(self, path=STATUS_STORE, interval=30):
+        self.path = path
+        self.interval = interval
+
+    def _load(self):
+        return read_json(self.path, {"updated": 0, "jobs": {}})
+
+    def register(self, *jobids, state="SUBMITTED"):
+        """Record freshly submitted jobs"""
+        with locked(self.path):
+            store = self._load()
+            for jobid in jobids:
+                store["jobs"][jobid] = {"state": state}
+            write_json(self.path, store)
+
+    def state(self, jobid):
+        """Return the cached state of a job, polling slurm if needed"""
+        store = self._load()
+        if self._fresh(store, jobid):
+            return store["jobs"][jobid]["state"]
+
+        with locked(self.path):
+            # Another status check may have polled while we waited
+            store = self._load()
+            if not self._fresh(store, jobid):
+                self._poll(store, jobid)
+                write_json(self.path, store)
+        return store["jobs"].get(jobid, {}).get("state")
+
+    def _fresh(self, store, jobid):
+        job = store["jobs"].get(jobid)
+        if job is None:
+            return False
+        if is_terminal(job["state"]):
+            return True
+        return time.time() - store["updated"] < self.interval
+
+    def _poll(self, store, jobid):
+        pending = [
+            job for job, info in store["jobs"].items()
+            if not is_terminal(info["state"])
+        ]
+        if jobid not in pending:
+            pending.append(jobid)
+        try:
+            states = sacct_states(pending)
+        except sp.CalledProcessError:
+            states = {}
+        for job, state in states.items():
+            store["jobs"].setdefault(job, {})["state"] = state
+        store["updated"] = time.time()
+
+
+class ArraySpool:
+    """
+    Group sibling jobs of the same rule into slurm job arrays.
+
+    Each job script is spooled into an open batch keyed on its rule and
+    sbatch options, and Snakemake receives a placeholder job identifier
+    (array:<batch>:<task>). A batch is submitted as a single array when
+    it is full, or when a submission or a status check finds it older
+    than the spooling window. Status checks then map the placeholder to
+    the <arrayid>_<task> slurm identifier.
+    """
+    def __init__(self, settings, path=ARRAY_SPOOL):
+        self.path = path
+        self.window = settings.get("array_window", 60)
+        self.max_size = settings.get("array_max_size", 100)
+        self.status_cache = settings.get("status_cache", False)
+
+    def _meta(self, batch):
+        return os.path.join(self.path, batch, "meta.json")
+
+    def add(self, rule, opts, jobscript):
+        """Spool a job script and return its placeholder identifier"""
+        key = hashlib.md5("{} {}".format(rule, opts).encode()).hexdigest()
+        with locked(self.path):
+            opened = read_json(os.path.join(self.path, "open.json"), {})
+            batch = opened.get(key)
+            meta = read_json(self._meta(batch), None) if batch else None
+            if meta is None or meta["jobid"] is not None:
+                batch = "{}-{}-{}".format(rule, key[:8], int(time.time()))
+                meta = {"rule": rule, "opts": opts, "created": time.time(),
+                        "size": 0, "jobid": None}
+                os.makedirs(os.path.join(self.path, batch), exist_ok=True)
+                opened[key] = batch
+                write_json(os.path.join(self.path, "open.json"), opened)
+
+            task = meta["size"]
+            shutil.copy(jobscript, os.path.join(
+                self.path, batch, "task.{}.sh".format(task)
+            ))
+            meta["size"] += 1
+            write_json(self._meta(batch), meta)
+
+            if meta["size"] >= self.max_size:
+                self._submit(batch, meta)
+            self._flush_expired(opened)
+        return "array:{}:{}".format(batch, task)
+
+    def resolve(self, placeholder):
+        """
+        Return the slurm identifier of a spooled job, submitting its batch
+        if the spooling window is over. None means not submitted yet.
+        """
+        _, batch, task = placeholder.split(":")
+        meta = read_json(self._meta(batch), None)
+        if meta is not None and meta["jobid"] is None:
+            if time.time() - meta["created"] < self.window:
+                return None
+            with locked(self.path):
+                meta = read_json(self._meta(batch), None)
+                if meta["jobid"] is None:
+                    self._submit(batch, meta)
+        if meta is None or meta["jobid"] == "failed":
+            return "failed"
+        return "{}_{}".format(meta["jobid"], task)
+
+    def _flush_expired(self, opened):
+        for batch in opened.values():
+            meta = read_json(self._meta(batch), None)
+            if meta is None or meta["jobid"] is not None:
+                continue
+            if time.time() - meta["created"] >= self.window:
+                self._submit(batch, meta)
+
+    def _submit(self, batch, meta):
+        """Submit a batch as one job array. Caller holds the lock."""
+        batch_dir = os.path.abspath(os.path.join(self.path, batch))
+        launcher = os.path.join(batch_dir, "array.sh")
+        with open(launcher, "w") as script:
+            script.write("#!/bin/bash\n")
+            script.write('exec bash "{}/task.${{SLURM_ARRAY_TASK_ID}}.sh"\n'
+                         .format(batch_dir))
+
+        cmd = "sbatch {opts} --array \"0-{last}\" --job-name \"{rule}\" {launcher}"
+        cmd = cmd.format(opts=meta["opts"], last=meta["size"] - 1,
+                         rule=meta["rule"], launcher=launcher)
+        try:
+            res = sp.run(cmd, check=True, shell=True, stdout=sp.PIPE)
+            m = re.search(r"Submitted batch job (\d+)", res.stdout.decode())
+            meta["jobid"] = m.group(1)
+        except (sp.CalledProcessError, AttributeError):
+            meta["jobid"] = "failed"
+        write_json(self._meta(batch), meta)
+
+        if self.status_cache and meta["jobid"] != "failed":
+            StatusStore().register(*[
+                "{}_{}".format(meta["jobid"], task)
+                for task in range(meta["size"])
+            ])
+
+
+class SinfoCache:
+    """
+    Persistent cache of sinfo answers, which change far less often than
+    jobs are submitted. Entries older than ttl seconds, or all entries
+    when refresh is set, are queried again.
+    """
+    def __init__(self, ttl=86400, refresh=False, path=SINFO_CACHE):
+        self.ttl = ttl
+        self.refresh = refresh
+        self.path = path
+
+    def get(self, key, query):
+        """Return the cached value of key, calling query() when stale"""
+        entry = read_json(self.path, {}).get(key)
+        if entry is not None and not self.refresh:
+            if time.time() - entry["time"] < self.ttl:
+                return entry["value"]
+
+        value = query()
+        with locked(self.path):
+            entries = read_json(self.path, {})
+            entries[key] = {"time": time.time(), "value": value}
+            write_json(self.path, entries)
+        return value
+
+
+class LocalPool:
+    """
+    Run short jobs as detached processes on the submit host, instead of
+    queueing them on slurm.
+
+    A job is run locally when its requested time is below local_max_min
+    minutes and it fits in the memory, cpu and job caps of the pool,
+    counting the local jobs still running. Jobs that already failed
+    locally during the same Snakemake run go to slurm. Snakemake receives
+    a placeholder identifier (local:<id>) which status checks answer from
+    the exit code file the job writes, or from its process when it has
+    not exited yet. Finished jobs of previous runs are forgotten. The
+    pool is disabled unless local_max_min is set.
+    """
+    def __init__(self, settings, path=LOCAL_POOL):
+        self.path = path
+        self.max_min = settings.get("local_max_min", 0)
+        self.max_mem_mb = settings.get("local_max_mem_mb", 0)
+        self.max_cpus = settings.get("local_max_cpus", 1)
+        self.max_jobs = settings.get("local_max_jobs", 1)
+
+    def _ledger(self):
+        return os.path.join(self.path, "jobs.json")
+
+    def _exit_code(self, jobid):
+        try:
+            with open(os.path.join(self.path, "{}.exit".format(jobid))) as code:
+                return int(code.read().strip() or 1)
+        except (OSError, ValueError):
+            return None
+
+    def _alive(self, job):
+        try:
+            os.kill(job["pid"], 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _running(self, jobs):
+        return [
+            job for jobid, job in jobs.items()
+            if self._exit_code(jobid) is None and self._alive(job)
+        ]
+
+    def add(self, job_properties, minutes, mem_mb, jobscript, key):
+        """
+        Start a job script locally if it is short enough and fits in the
+        pool. Return its placeholder identifier, or None for slurm.
+        """
+        cpus = int(job_properties.get("threads", 1))
+        try:
+            minutes, mem_mb = float(minutes), float(mem_mb)
+        except (TypeError, ValueError):
+            # Unknown or slurm-formatted (e.g. 4G) requests go to slurm
+            return None
+        if self.max_min <= 0 or minutes > self.max_min or cpus > self.max_cpus:
+            return None
+        with locked(self._ledger()):
+            jobs = read_json(self._ledger(), {})
+            # Job scripts of a Snakemake run share its temporary directory
+            run = os.path.dirname(os.path.abspath(jobscript))
+            finished = [
+                jobid for jobid, job in jobs.items()
+                if job.get("run") != run and job not in self._running(jobs)
+            ]
+            for jobid in finished:
+                del jobs[jobid]
+                for suffix in (".sh", ".exit"):
+                    path = os.path.join(self.path, jobid + suffix)
+                    if os.path.exists(path):
+                        os.remove(path)
+            if finished:
+                write_json(self._ledger(), jobs)
+            if any(job["key"] == key and job.get("failed")
+                   for job in jobs.values()):
+                return None
+            running = self._running(jobs)
+            if (len(running) >= self.max_jobs
+                    or sum(job["mem_mb"] for job in running) + mem_mb
+                    > self.max_mem_mb
+                    or sum(job["cpus"] for job in running) + cpus
+                    > self.max_cpus):
+                return None
+
+            # Identifiers are never reused, even once forgotten
+            jobid = str(time.time_ns())
+            script = os.path.join(self.path, "{}.sh".format(jobid))
+            shutil.copy(jobscript, script)
+            log = os.path.join(
+                "logs", "slurm", "local-{}-{}".format(
+                    job_properties.get("rule", "job"), jobid
+                )
+            )
+            os.makedirs(os.path.dirname(log), exist_ok=True)
+            # The exit code is written atomically once the job is over
+            exit_file = os.path.join(self.path, "{}.exit".format(jobid))
+            command = ("bash {script} > {log}.out 2> {log}.err; "
+                       "echo $? > {exit}.tmp && mv {exit}.tmp {exit}").format(
+                script=shlex.quote(script), log=shlex.quote(log),
+                exit=shlex.quote(exit_file)
+            )
+            process = sp.Popen(
+                ["bash", "-c", command], stdin=sp.DEVNULL,
+                stdout=sp.DEVNULL, stderr=sp.DEVNULL, start_new_session=True
+            )
+            jobs[jobid] = {"key": key, "pid": process.pid, "cpus": cpus,
+                           "mem_mb": mem_mb, "started": time.time(),
+                           "run": run}
+            write_json(self._ledger(), jobs)
+        return "local:{}".format(jobid)
+
+    def status(self, placeholder):
+        """
+        Return the status of a local job, as Snakemake expects it:
+        running, success or failed
+        """
+        jobid = placeholder.split(":")[1]
+        code = self._exit_code(jobid)
+        if code is None:
+            job = read_json(self._ledger(), {}).get(jobid)
+            if job is not None and self._alive(job):
+                return "running"
+            # Give a job that just exited the time to write its code
+            time.sleep(1)
+            code = self._exit_code(jobid)
+        if code == 0:
+            return "success"
+        with locked(self._ledger()):
+            jobs = read_json(self._ledger(), {})
+            if jobid in jobs:
+                jobs[jobid]["failed"] = True
+                write_json(self._ledger(), jobs)
+        return "failed"
@@ -0,0 +1,49 @@
+"""
+This rule annotates the segments of all samples in a single job: the
+gene index is memory-mapped once, and overlaps are searched with
+vectorised interval queries. It writes TargetGenes and TruncatedGenes
+tables under annotation/. The HTML reports of EaCoN_Annotate are left
+unchanged.
+"""
+rule gene_annotation:
+    input:
+        index = f"databases/gene_index.{config['params']['genome']}.bin",
+        segments = expand(
+            os.sep.join([
+                "{sample}", config["params"]["segmenter"], "L2R",
+                "{sample}.Cut.cbs"
+            ]),
+            sample=sample_id_list
+        )
+    output:
+        target = expand(
+            "annotation/{sample}.TargetGenes.txt", sample=sample_id_list
+        ),
+        truncated = expand(
+            "annotation/{sample}.TruncatedGenes.txt", sample=sample_id_list
+        )
+    message:
+        "Annotating genes of {} samples".format(len(sample_id_list))
+    threads: 1
+    resources:
+        mem_mb = (
+            lambda wildcards, attempt: min(attempt * 2048, 8192)
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(attempt * 30, 180)
+        )
+    conda:
+        "../envs/segment_store.yaml"
+    params:
+        files = "logs/annotation/files.tsv",
+        script = op.join(config["params"]["scripts"], "gene_annotation.py")
+    log:
+        "logs/annotation/gene_annotation.log"
+    shell:
+        # Paths look like {sample}/{segmenter}/L2R/{sample}.Cut.cbs
+        "mkdir --parents $(dirname {params.files}) && "
+        "for path in {input.segments}; do "
+        "printf '%s\\t%s\\n' \"${{path%%/*}}\" \"${{path}}\"; "
+        "done > {params.files} && "
+        "python3 {params.script} --manifest {params.files} "
+        "--index {input.index} --output annotation > {log} 2>&1"
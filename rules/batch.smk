@@ -0,0 +1,122 @@
+"""
+These rules process samples by batches of `batch_size` in a single R
+session: EaCoN and its APT annotation packages are loaded once per batch
+instead of once per sample and per step. Results are written in a
+staging directory, then moved into place sample per sample, so that a
+bad CEL file only fails its own sample. Batches are named after a hash
+of their members, and processed samples stay in their batch when the
+design changes.
+"""
+ruleorder: EaCoN_batch_unpack > EaCoN_process
+ruleorder: EaCoN_batch_unpack > EaCoN_segment
+localrules: EaCoN_batch_unpack
+
+
+"""
+This rule performs normalisation and segmentation of a batch of samples
+"""
+rule EaCoN_batch:
+    input:
+        EaCoN_batch_in
+    output:
+        "batches/{batch}/status.tsv"
+    message:
+        "Processing and segmenting samples of {wildcards.batch}"
+    resources:
+        mem_mb = (
+            lambda wildcards, attempt: min(attempt * 1024 + 5120, 7168)
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(
+                attempt * 120 * len(batches_dict[wildcards.batch]), 10080
+            )
+        )
+    threads:
+        1
+    priority:
+        step_priority("EaCoN_batch")
+    params:
+        cels = lambda wildcards: {
+            sample: sample_cels(sample)
+            for sample in batches_dict[wildcards.batch]
+        },
+        staging = lambda wildcards: op.join("batches", wildcards.batch)
+    wildcard_constraints:
+        batch = r"batch-?[0-9a-f]+"
+    log:
+        "logs/EaCoN/{batch}.log"
+    script:
+        "../scripts/EaCoN_batch.R"
+
+
+"""
+This rule moves the results of one sample out of its batch staging
+directory, or fails if EaCoN could not process this very sample
+"""
+rule EaCoN_batch_unpack:
+    input:
+        status = lambda wildcards: op.join(
+            "batches", sample_batch(wildcards.sample), "status.tsv"
+        )
+    output:
+        qc = expand(
+            op.join("{sample}", "{sample}_2.4.0_{nar}.{ext}"),
+            sample="{sample}",
+            nar=config["params"]["nar"],
+            ext=paircheck_qc()
+        ),
+        qc2 = expand(
+            op.join("{sample}", "{sample}_{ext}"),
+            sample="{sample}",
+            ext=plot_qc()
+        ),
+        rds = op.join(
+            "{sample}",
+            "{sample}_{}_{}_processed.RDS".format(
+                config['params']['arraytype'],
+                config['params']['genome'],
+                sample="{sample}"
+            )
+        ),
+        files = expand(
+            os.sep.join([
+                "{sample}", config["params"]["segmenter"], "L2R",
+                "{sample}.{ext}"
+            ]),
+            sample="{sample}",
+            ext=["Cut.cbs", "NoCut.cbs", "Rorschach.png", "SegmentedBAF.txt"]
+        ),
+        seg_rds = os.sep.join([
+            "{sample}", config["params"]["segmenter"], "L2R",
+            f"{{sample}}.SEG.{config['params']['segmenter']}.RDS"
+        ]),
+        segment_png = report(
+            os.sep.join([
+                "{sample}", config["params"]["segmenter"], "L2R",
+                f"{{sample}}.SEG.{config['params']['segmenter']}.png"
+            ]),
+            category="BAF and L2R",
+            caption="../report/aspcf.rst"
+        )
+    message:
+        "Collecting {wildcards.sample} from its batch"
+    params:
+        staging = lambda wildcards: op.join(
+            "batches", sample_batch(wildcards.sample)
+        )
+    wildcard_constraints:
+        sample = r"[^/]+"
+    log:
+        "logs/EaCoN/{sample}_unpack.log"
+    run:
+        with open(input.status) as status_file:
+            status = dict(
+                line.rstrip("\n").split("\t")[:2] for line in status_file
+            )
+        if status.get(wildcards.sample) != "ok":
+            raise ValueError(
+                f"EaCoN failed on {wildcards.sample}, "
+                f"see logs/EaCoN/{sample_batch(wildcards.sample)}.log"
+            )
+        for path in output:
+            os.replace(op.join(params.staging, path), path)
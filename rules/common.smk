@@ -4,69 +4,164 @@ one gathers all the python instructions surch as config mappings or input
 validations.
 """
 
+import glob
+import hashlib
+import json
+import math
+import os
 import os.path as op
-import pandas as pd
+import sys
+import time
+import yaml
+
+from itertools import product
 
 from snakemake.utils import validate
-from typing import Dict, List
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, op.join(workflow.basedir, "scripts"))
+from resource_model import fit_models, predict, read_history, record
 
 # Git prefix
 git = "https://raw.githubusercontent.com/tdayris/snakemake-wrappers/Unofficial"
 
-# Loading configuration
+# Granularity of predicted resources
+RESOURCE_BUCKETS = {"mem_mb": 512, "time_min": 15}
+
+
+def load_design() -> Dict[str, Any]:
+    """
+    Validate configuration and design, then resolve CEL file paths. The
+    result is cached in .snakemake/design_cache.json, keyed on the
+    configuration and on the design and schema files: cluster jobs and
+    later runs neither import pandas, nor validate, nor resolve CEL paths
+    and sizes on cold storage again.
+    """
+    schemas = {
+        name: op.join(workflow.basedir, "schemas", f"{name}.schema.yaml")
+        for name in ("config", "design")
+    }
+    key = hashlib.sha1(json.dumps({
+        "config": config,
+        "files": {
+            path: [os.stat(path).st_mtime_ns, os.stat(path).st_size]
+            for path in [config["design"], *schemas.values()]
+        }
+    }, sort_keys=True, default=str).encode()).hexdigest()
+    cache_path = op.join(".snakemake", "design_cache.json")
+    try:
+        with open(cache_path) as cache:
+            cached = json.load(cache)
+        if cached["key"] == key and "cel_size" in cached:
+            return cached
+    except (OSError, ValueError, KeyError):
+        pass
+
+    import pandas as pd
+    validate(config, schema=schemas["config"])
+    design = pd.read_csv(
+        config["design"],
+        sep="\t",
+        header=0,
+        index_col=None
+    )
+    validate(design, schema=schemas["design"])
+    cel_columns = [
+        column for column in ("ATChannelCel", "GCChannelCel", "CEL")
+        if column in design.columns
+    ]
+    cached = {
+        "key": key,
+        "columns": design.columns.tolist(),
+        "samples": design.astype(str).to_dict(orient="records"),
+        "cel_link": {
+            op.basename(cel): op.realpath(cel)
+            for column in cel_columns
+            for cel in design[column]
+        }
+    }
+    # Sizes feed resource predictions, without touching cold storage again
+    cached["cel_size"] = {
+        name: op.getsize(path) for name, path in cached["cel_link"].items()
+    }
+    os.makedirs(op.dirname(cache_path), exist_ok=True)
+    partial = f"{cache_path}.{os.getpid()}.tmp"
+    with open(partial, "w") as cache:
+        json.dump(cached, cache)
+    os.replace(partial, cache_path)
+    return cached
+
+
+# Loading configuration and design file
 # configfile: "config.yaml"
-validate(config, schema="../schemas/config.schema.yaml")
-
-# Loading design file
-design = pd.read_csv(
-    config["design"],
-    sep="\t",
-    header=0,
-    index_col=None
-)
-design.set_index(design["Sample_id"])
-validate(design, schema="../schemas/design.schema.yaml")
+design_cache = load_design()
 
 
 def is_cytoscan() -> bool:
     """
     Return true if analysis is Cytoscan
     """
-    return "ATChannelCel" in design.columns.tolist()
+    return "ATChannelCel" in design_cache["columns"]
 
 
-def EaCoN_in(wildcards) -> Dict[str, str]:
+def sample_cel_files() -> Dict[str, Dict[str, str]]:
     """
-    This function returns the correct couple of samples
+    This function maps each sample to its staged CEL file(s), named after
+    the design: OncoScan channels are not always named after their sample
     """
-    if is_cyto_bool is True:
-        return {
-            "ATChannelCel": f"raw_data/{wildcards.sample}_A.CEL",
-            "GCChannelCel": f"raw_data/{wildcards.sample}_C.CEL"
-        }
+    columns = (
+        ["ATChannelCel", "GCChannelCel"] if is_cyto_bool is True else ["CEL"]
+    )
     return {
-        "CEL": f"raw_data/{wildcards.sample}.CEL"
+        row["Sample_id"]: {
+            column: f"raw_data/{op.basename(row[column])}"
+            for column in columns
+        }
+        for row in design_cache["samples"]
     }
 
 
+def sample_cels(sample: str) -> Dict[str, str]:
+    """
+    This function returns the correct couple of CEL files for a sample
+    """
+    return sample_cels_dict[sample]
+
+
+def EaCoN_in(wildcards) -> Dict[str, str]:
+    """
+    This function returns the correct couple of samples
+    """
+    return sample_cels(wildcards.sample)
+
+
 def cel_link() -> Dict[str, str]:
     """
     This function links the samples and their filename just like:
     sample file name : sample path
     """
-    # Will cause KeyError on single stranded Cytoscan analysis
-    # Better ask forgiveness than permission !
-    try:
-        # Cytoscan case
-        cel_list = chain(design["ATChannelCel"], design["GCChannelCel"])
-    except KeyError:
-        # Oncoscan case
-        cel_list = design["CEL"]
-    finally:
-        return {
-            op.basename(cel): op.realpath(cel)
-            for cel in cel_list
-        }
+    return design_cache["cel_link"]
+
+
+def cold_storage_points() -> List[str]:
+    """
+    Return the cold storage mount points listed in the yaml file(s)
+    given as `cold_storage` in the configuration. Missing files list no
+    mount point: CEL files are then all copied.
+    """
+    paths = config.get("cold_storage", [])
+    if isinstance(paths, str):
+        paths = [paths]
+    points = []
+    for path in paths:
+        if not op.exists(path):
+            print(f"Cold storage file {path} not found", file=sys.stderr)
+            continue
+        with open(path) as cold_storage_yaml:
+            points += (
+                yaml.safe_load(cold_storage_yaml) or {}
+            ).get("cold_storage", [])
+    return points
 
 
 def paircheck_qc() -> List[str]:
@@ -97,10 +192,327 @@ def sample_id() -> List[str]:
     """
     Return the list of sample identifiers
     """
-    return design["Sample_id"].tolist()
+    return [row["Sample_id"] for row in design_cache["samples"]]
+
+
+def batch_size() -> int:
+    """
+    Return the number of samples processed together in one R session
+    """
+    return max(int(config.get("batch_size", 0)), 1)
+
+
+def sample_batch(sample: str) -> str:
+    """
+    Return the name of the batch a sample belongs to
+    """
+    return sample_batch_dict[sample]
+
+
+def sample_batches() -> Dict[str, List[str]]:
+    """
+    Split samples into chunks of `batch_size` samples. Processed samples
+    keep the batch whose status.tsv reports them; other ones are ordered
+    by a hash of their name, and each chunk is named after a hash of its
+    members. Reordering or appending samples never moves a processed
+    sample into another batch.
+    """
+    batches = {}
+    samples = set(sample_id_list)
+    done = set()
+    for status in sorted(glob.glob(op.join("batches", "*", "status.tsv"))):
+        with open(status) as status_file:
+            processed = [
+                sample for sample, state in (
+                    line.rstrip("\n").split("\t")[:2]
+                    for line in status_file if line.strip()
+                )
+                if state == "ok" and sample in samples and sample not in done
+            ]
+        if processed:
+            batches[op.basename(op.dirname(status))] = processed
+            done.update(processed)
+
+    pending = sorted(
+        (sample for sample in sample_id_list if sample not in done),
+        key=lambda sample: hashlib.md5(sample.encode()).hexdigest()
+    )
+    for first in range(0, len(pending), batch_size()):
+        members = pending[first:first + batch_size()]
+        digest = hashlib.md5(" ".join(sorted(members)).encode()).hexdigest()
+        batches[f"batch-{digest[:12]}"] = members
+    return batches
+
+
+def sample_sources(wildcards) -> List[str]:
+    """
+    Return the original CEL files of a sample, whose checksums key the
+    shared result cache
+    """
+    return [
+        cel_link_dict[op.basename(cel)]
+        for cel in sample_cels(wildcards.sample).values()
+    ]
+
+
+def EaCoN_batch_in(wildcards) -> List[str]:
+    """
+    Return all the CEL files of a batch
+    """
+    return [
+        cel
+        for sample in batches_dict[wildcards.batch]
+        for cel in sample_cels(sample).values()
+    ]
+
+
+def gis_samples() -> List[str]:
+    """
+    Return the samples whose gammaEval.txt and Cut.cbs already exist,
+    scored together by cohort_GIS
+    """
+    if config.get("cohort_gis", False) is not True:
+        return []
+    segmenter = config["params"]["segmenter"]
+    return [
+        sample for sample in sample_id_list
+        if op.exists(op.join(sample, segmenter, "ASCN",
+                             f"{sample}.gammaEval.txt"))
+        and op.exists(op.join(sample, segmenter, "L2R", f"{sample}.Cut.cbs"))
+    ]
+
+
+def sweep_combinations() -> Dict[str, Dict[str, Any]]:
+    """
+    Return each combination of the segmentation parameters grid given
+    under `sweep`, named after the swept values (e.g. nrf-0.5__ser_pen-20)
+    """
+    grid = config.get("sweep") or {}
+    names = sorted(grid.keys())
+    return {
+        "__".join(f"{name}-{value}" for name, value in zip(names, values)):
+            dict(zip(names, values))
+        for values in product(*(grid[name] for name in names))
+    } if names else {}
+
+
+def cel_size_mb(sample: str) -> float:
+    """
+    Return the size of the original CEL file(s) of a sample, in MB, as
+    cached with the design
+    """
+    return sum(
+        design_cache["cel_size"][op.basename(cel)]
+        for cel in sample_cels(sample).values()
+    ) / 1024 ** 2
+
+
+def resource_models() -> Dict[Any, Any]:
+    """
+    Return the resource models fitted on the history given as
+    `resource_history`, fitting them on first call only
+    """
+    global resource_models_dict
+    if resource_models_dict is None:
+        resource_models_dict = fit_models(
+            read_history(config.get("resource_history", ""))
+        )
+    return resource_models_dict
+
+
+def last_failure(rule: str, wildcards) -> Dict[str, Any]:
+    """
+    Return why the previous attempt of a job failed on Slurm, as recorded
+    by the profile status script during this run, or an empty dict
+    """
+    key = "{}:{}".format(rule, ",".join(
+        f"{name}={value}" for name, value in sorted(wildcards.items())
+    ))
+    try:
+        with open(op.join(".snakemake", "slurm-failures.json")) as ledger:
+            failure = json.load(ledger).get(key, {})
+    except (OSError, ValueError):
+        return {}
+    if failure.get("recorded", 0) < workflow_start:
+        return {}
+    return failure
+
+
+def partition_limit(resource: str) -> int:
+    """
+    Return the largest amount of a resource a Slurm partition offers, as
+    cached by the profile submission script, or the longest time limit
+    it accepts when nothing is cached
+    """
+    global partition_limits_dict
+    if partition_limits_dict is None:
+        sinfo_cache = op.join(
+            os.environ.get("XDG_CACHE_HOME", op.expanduser("~/.cache")),
+            "cel-cnv-eacon", "sinfo.json"
+        )
+        try:
+            with open(sinfo_cache) as sinfo:
+                entries = json.load(sinfo)
+        except (OSError, ValueError):
+            entries = {}
+        times, memories = [], []
+        for key, entry in entries.items():
+            if key.startswith("configuration:"):
+                times.append(int(entry["value"]["time"]))
+            elif key.startswith("features:"):
+                memories += [int(node["mem"]) for node in entry["value"]]
+        partition_limits_dict = {
+            "time_min": max(times, default=86399),
+            "mem_mb": max(memories, default=sys.maxsize)
+        }
+    return partition_limits_dict[resource]
+
+
+def escalated(rule: str,
+              resource: str,
+              wildcards,
+              attempt: int) -> Optional[int]:
+    """
+    Return the amount of a resource for a retry, knowing why the previous
+    attempt failed: the exhausted resource goes to 1.5 times what was
+    used, other ones keep what was requested, node failures and
+    preemptions are resubmitted as they were, and nothing goes over the
+    largest partition. Returns None when the cause of the failure is
+    unknown.
+    """
+    failure = last_failure(rule, wildcards) if attempt > 1 else {}
+    exhausted = {"OUT_OF_MEMORY": "mem_mb", "TIMEOUT": "time_min"}
+    resubmitted = ("BOOT_FAIL", "NODE_FAIL", "PREEMPTED")
+    if failure.get("state") not in list(exhausted) + list(resubmitted):
+        return None
+
+    used, requested = {
+        "mem_mb": ("max_rss_mb", "req_mem_mb"),
+        "time_min": ("elapsed_min", "timelimit_min")
+    }[resource]
+    limit = partition_limit(resource)
+    if exhausted.get(failure["state"]) == resource:
+        peak = max(failure.get(used) or 0, failure.get(requested) or 0)
+        return min(int(math.ceil(peak * 1.5)), limit) if peak > 0 else None
+    if failure.get(requested):
+        return min(int(math.ceil(failure[requested])), limit)
+    return None
+
+
+def predicted(rule_name: str, resource: str, default: Callable) -> Callable:
+    """
+    Return a resource callable predicting the needs of a sample from the
+    jobs recorded in `resource_history`. Rules without enough history use
+    their default callable. Retries of jobs that failed on Slurm only
+    raise the exhausted resource. Other retries ask 50% more than the
+    prediction, and never less than the default would. Predictions are
+    rounded up to coarse buckets, so that jobs of a same rule share their
+    sbatch options and can still be grouped in job arrays.
+    """
+    def resource_callable(wildcards, attempt):
+        retry = escalated(rule_name, resource, wildcards, attempt)
+        if retry is not None:
+            return retry
+        fallback = default(wildcards, attempt)
+        value = predict(
+            resource_models(),
+            rule_name,
+            config["params"]["arraytype"],
+            cel_size_mb(wildcards.sample),
+            resource
+        )
+        if value is None:
+            return fallback
+        value *= 1.5 ** (attempt - 1)
+        if attempt > 1:
+            value = max(value, fallback)
+        bucket = RESOURCE_BUCKETS.get(resource, 1)
+        return max(int(math.ceil(value / bucket)) * bucket, bucket)
+    return resource_callable
+
+
+def depth_first() -> bool:
+    """
+    Return true when samples are scheduled depth-first
+    """
+    return config.get("scheduling", "breadth") == "depth"
+
+
+def step_priority(rule: str) -> int:
+    """
+    Return the priority of an EaCoN step. Depth-first, each step of a
+    sample outranks the previous one, so started samples are finished
+    before new ones are processed.
+    """
+    if not depth_first():
+        return {
+            "EaCoN_process": 30, "EaCoN_sample": 30, "EaCoN_batch": 30
+        }.get(rule, 0)
+    return {
+        "EaCoN_process": 30,
+        "EaCoN_sample": 30,
+        "EaCoN_batch": 30,
+        "EaCoN_segment": 35,
+        "EaCoN_ascn": 40,
+        "EaCoN_GIS": 45,
+        "EaCoN_Annotate": 45
+    }[rule]
+
+
+def max_in_flight() -> int:
+    """
+    Return the maximum number of per-sample EaCoN jobs running at once,
+    0 for no limit. Only depth-first scheduling caps them.
+    """
+    return int(config.get("max_in_flight", 0)) if depth_first() else 0
+
+
+def record_resources() -> None:
+    """
+    Append the benchmarks of this run to `resource_history`
+    """
+    if not config.get("resource_history"):
+        return
+    benchmarks = [
+        (op.basename(op.dirname(path)), op.basename(path)[:-len(".tsv")], path)
+        for path in glob.glob(op.join("benchmarks", "*", "*.tsv"))
+    ]
+    recorded = record(
+        config["resource_history"],
+        benchmarks,
+        config["params"]["arraytype"],
+        {
+            sample: cel_size_mb(sample)
+            for _, sample, _ in benchmarks
+            if sample in sample_cels_dict
+        }
+    )
+    print(f"{recorded} job(s) added to {config['resource_history']}",
+          file=sys.stderr)
 
 
 # Instanciate variables
 cel_link_dict = cel_link()
 is_cyto_bool = is_cytoscan()
+sample_cels_dict = sample_cel_files()
 sample_id_list = sample_id()
+batches_dict = sample_batches()
+sample_batch_dict = {
+    sample: batch for batch, samples in batches_dict.items()
+    for sample in samples
+}
+gis_sample_list = gis_samples()
+sweep_dict = sweep_combinations()
+resource_models_dict = None
+partition_limits_dict = None
+# Per-sample EaCoN jobs take one `in_flight` slot each: with depth-first
+# priorities, a freed slot goes to the next step of a started sample
+# rather than to a new sample. Failed samples simply free their slot.
+if max_in_flight() > 0:
+    workflow.global_resources.setdefault("in_flight", max_in_flight())
+# CEL files are staged by one job each, so that staged files are kept
+# when others fail; `stage_slots` bounds the concurrent transfers.
+workflow.global_resources.setdefault(
+    "stage_slots", config.get("stage_workers", 4)
+)
+workflow_start = time.time()
@@ -2,24 +2,30 @@
 On most clusters, cold and hot storage coexist. Non-expert users might
 try to run IO intensive processes on data through cold storage and break
 either the pipeline or the mounting points on a cluster. This rule
-copies the fastq files.
-More information at:
-https://github.com/tdayris/yawn/tree/master/SnakemakeWrappers/cp/8.25
+stages each CEL file with checksum verification, at most `stage_workers`
+at once. Each file is its own job, so verified files are kept when other
+transfers fail or new samples arrive. Only files on cold storage are
+copied: other ones are reflinked, hard-linked or symlinked. Without cold
+storage mount points, all files are copied. Decisions are recorded in a
+per-file staging report.
 """
-rule copy_cel:
+rule stage_cel:
     input:
         lambda wildcards: cel_link_dict[wildcards.sample]
     output:
-        temp("raw_data/{sample}")
+        cel = temp("raw_data/{sample}"),
+        transfers = temp("logs/copy/{sample}.transfers.tsv"),
+        report = "logs/copy/{sample}.staged.tsv"
     message:
-        "Copying {wildcards.sample} for further process"
+        "Staging {wildcards.sample} for further process"
     resources:
         mem_mb = (
             lambda wildcards, attempt: min(attempt * 128, 512)
         ),
         time_min = (
             lambda wildcards, attempt: min(attempt * 1440, 2832)
-        )
+        ),
+        stage_slots = 1
     log:
         "logs/copy/{sample}.log"
     wildcard_constraints:
@@ -29,7 +35,12 @@ rule copy_cel:
     priority:
         1
     params:
-        extra = config["params"].get("copy_extra", ""),
-        cold_storage = config.get("cold_storage", "NONE")
-    wrapper:
-        f"{git}/bio/cp"
+        extra = config["params"].get("stage_extra", ""),
+        script = op.join(config["params"]["scripts"], "stage_cel.py"),
+        cold_storage = " ".join(cold_storage_points())
+    shell:
+        "printf '%s\\t%s\\n' {input} {output.cel} > {output.transfers} && "
+        "python3 {params.script} --manifest {output.transfers} "
+        "--output {output.report} --workers 1 {params.extra} "
+        "--cold-storage {params.cold_storage} "
+        "> {log} 2>&1"
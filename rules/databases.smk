@@ -0,0 +1,44 @@
+"""
+This rule converts the refGene, HGNC and COSMIC sources of the ldb mirror
+into a binary gene index for the configured genome. Its output is kept
+in Snakemake's between-workflow cache (see `cache` in the Slurm profile
+and SNAKEMAKE_OUTPUT_CACHE in run.sh): the cache key includes a checksum
+of the sources, so the index is built once per genome and database
+version, then shared by every project.
+"""
+rule eacon_databases:
+    input:
+        [
+            path for path in (
+                op.join(config["params"]["ldb"], *parts) for parts in (
+                    ("GoldenPath", config["params"]["genome"],
+                     f"refGene.{config['params']['genome']}"),
+                    ("HGNC", "HGNC_Hugo.txt"),
+                    ("COSMIC_cancer_census", "Census_all.tsv")
+                )
+            )
+            if op.exists(path)
+        ]
+    output:
+        f"databases/gene_index.{config['params']['genome']}.bin"
+    message:
+        "Indexing {} genes from ldb".format(config["params"]["genome"])
+    threads: 1
+    resources:
+        mem_mb = (
+            lambda wildcards, attempt: min(attempt * 2048, 8192)
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(attempt * 15, 60)
+        )
+    conda:
+        "../envs/segment_store.yaml"
+    params:
+        ldb = config["params"]["ldb"],
+        genome = config["params"]["genome"],
+        script = op.join(config["params"]["scripts"], "gene_index.py")
+    log:
+        "logs/annotation/eacon_databases.log"
+    shell:
+        "python3 {params.script} --ldb {params.ldb} --genome {params.genome} "
+        "--output {output} > {log} 2>&1"
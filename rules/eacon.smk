@@ -27,20 +27,27 @@ rule EaCoN_process:
     message:
         "Processing {wildcards.sample} CEL file(s)"
     resources:
-        mem_mb = (
+        in_flight = 1,
+        mem_mb = predicted(
+            "EaCoN_process", "mem_mb",
             lambda wildcards, attempt: min(attempt * 1024 + 5120, 7168)
         ),
-        time_min = (
+        time_min = predicted(
+            "EaCoN_process", "time_min",
             lambda wildcards, attempt: min(attempt * 60, 240)
         )
     threads:
         1
     priority:
-        30
+        step_priority("EaCoN_process")
     #conda:
     #    "env/eacon_dependencies.yaml"
     wildcard_constraints:
         sample = r"[^/]+"
+    params:
+        cel_sources = sample_sources
+    benchmark:
+        "benchmarks/EaCoN_process/{sample}.tsv"
     log:
         "logs/EaCoN/{sample}_process.log"
     script:
@@ -84,15 +91,24 @@ rule EaCoN_segment:
     message:
         "Segmentation of {wildcards.sample} normalized data"
     threads: 1
+    priority:
+        step_priority("EaCoN_segment")
     #conda:
     #    "env/eacon_dependencies.yaml"
     resources:
-        mem_mb = (
+        in_flight = 1,
+        mem_mb = predicted(
+            "EaCoN_segment", "mem_mb",
             lambda wildcards, attempt: min(attempt * 4096, 5120)
         ),
-        time_min = (
+        time_min = predicted(
+            "EaCoN_segment", "time_min",
             lambda wildcards, attempt: min(attempt * 60, 180)
         )
+    params:
+        cel_sources = sample_sources
+    benchmark:
+        "benchmarks/EaCoN_segment/{sample}.tsv"
     log:
         "logs/EaCoN/{sample}_Segmentation.log"
     script:
@@ -127,15 +143,24 @@ rule EaCoN_ascn:
     message:
         "Building copy number models for {wildcards.sample}"
     threads: 1
+    priority:
+        step_priority("EaCoN_ascn")
     #conda:
     #    "env/eacon_dependencies.yaml"
     resources:
-        mem_mb = (
+        in_flight = 1,
+        mem_mb = predicted(
+            "EaCoN_ascn", "mem_mb",
             lambda wildcards, attempt: min(attempt * 4096, 5120)
         ),
-        time_min = (
+        time_min = predicted(
+            "EaCoN_ascn", "time_min",
             lambda wildcards, attempt: min(attempt * 45, 180)
         )
+    params:
+        cel_sources = sample_sources
+    benchmark:
+        "benchmarks/EaCoN_ascn/{sample}.tsv"
     log:
         "logs/EaCoN/{sample}_ascn.log"
     script:
@@ -160,15 +185,22 @@ rule EaCoN_GIS:
     output:
         "{sample}/{sample}_GIS_from_best_gamma.txt"
     threads: 1
+    priority:
+        step_priority("EaCoN_GIS")
     #conda:
     #    "env/eacon_dependencies.yaml"
     resources:
-        mem_mb = (
+        in_flight = 1,
+        mem_mb = predicted(
+            "EaCoN_GIS", "mem_mb",
             lambda wildcards, attempt: min(attempt * 4096, 5120)
         ),
-        time_min = (
+        time_min = predicted(
+            "EaCoN_GIS", "time_min",
             lambda wildcards, attempt: min(attempt * 45, 180)
         )
+    benchmark:
+        "benchmarks/EaCoN_GIS/{sample}.tsv"
     log:
         "logs/EaCoN/{sample}_ascn.log"
     wrapper:
@@ -218,15 +250,24 @@ rule EaCoN_Annotate:
     message:
         "Reporting data for {wildcards.sample}"
     threads: 1
+    priority:
+        step_priority("EaCoN_Annotate")
     #conda:
     #    "env/eacon_dependencies.yaml"
     resources:
-        mem_mb = (
+        in_flight = 1,
+        mem_mb = predicted(
+            "EaCoN_Annotate", "mem_mb",
             lambda wildcards, attempt: min(attempt * 4096, 10240)
         ),
-        time_min = (
+        time_min = predicted(
+            "EaCoN_Annotate", "time_min",
             lambda wildcards, attempt: min(attempt * 45, 180)
         )
+    params:
+        cel_sources = sample_sources
+    benchmark:
+        "benchmarks/EaCoN_Annotate/{sample}.tsv"
     log:
         "logs/EaCoN/{sample}_annotate.log"
     script:
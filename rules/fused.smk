@@ -0,0 +1,106 @@
+"""
+This rule runs the whole EaCoN chain of a sample in a single R session:
+normalisation, segmentation, copy number models and annotation. EaCoN
+is loaded once, and the processed data never goes through an RDS file.
+It replaces EaCoN_process, EaCoN_segment, EaCoN_ascn and EaCoN_Annotate
+when `fused` is set in the configuration file.
+"""
+ruleorder: EaCoN_sample > EaCoN_process
+ruleorder: EaCoN_sample > EaCoN_segment
+ruleorder: EaCoN_sample > EaCoN_ascn
+ruleorder: EaCoN_sample > EaCoN_Annotate
+
+
+rule EaCoN_sample:
+    input:
+        unpack(EaCoN_in)
+    output:
+        qc = expand(
+            op.join("{sample}", "{sample}_2.4.0_{nar}.{ext}"),
+            sample="{sample}",
+            nar=config["params"]["nar"],
+            ext=paircheck_qc()
+        ),
+        qc2 = expand(
+            op.join("{sample}", "{sample}_{ext}"),
+            sample="{sample}",
+            ext=plot_qc()
+        ),
+        seg_files = expand(
+            os.sep.join([
+                "{sample}", config["params"]["segmenter"], "L2R",
+                "{sample}.{ext}"
+            ]),
+            sample="{sample}",
+            ext=["Cut.cbs", "NoCut.cbs", "Rorschach.png", "SegmentedBAF.txt",
+                 "BAF.png", "Cut.acbs", "Instab.txt", "INT.png",
+                 "L2R.G.png", "L2R.K.png", "TargetGenes.txt",
+                 "TruncatedGenes.txt"]
+        ),
+        seg_rds = os.sep.join([
+            "{sample}", config["params"]["segmenter"], "L2R",
+            f"{{sample}}.SEG.{config['params']['segmenter']}.RDS"
+        ]),
+        segment_png = report(
+            os.sep.join([
+                "{sample}", config["params"]["segmenter"], "L2R",
+                f"{{sample}}.SEG.{config['params']['segmenter']}.png"
+            ]),
+            category="BAF and L2R",
+            caption="../report/aspcf.rst"
+        ),
+        gama_eval_png = report(
+            os.sep.join(["{sample}", config["params"]["segmenter"],
+                         "ASCN", "{sample}.gammaEval.png"]),
+            category="ASCN Model",
+            caption="../report/ascn.rst"
+        ),
+        gama_eval_txt = os.sep.join([
+            "{sample}", config["params"]["segmenter"],
+            "ASCN", "{sample}.gammaEval.txt"
+        ]),
+        chromosomes = expand(
+            os.sep.join([
+                "{sample}", config["params"]["segmenter"],
+                "L2R", "chromosomes", "{chr}.png"
+            ]),
+            sample="{sample}",
+            chr=[f"chr{i}" for i in list(map(str, range(1, 23))) + ["X", "Y"]]
+        ),
+        html = report(
+            os.path.sep.join([
+                "{sample}", config["params"]["segmenter"], "L2R",
+                "{sample}.REPORT.html"
+            ]),
+            caption="../report/html.rst",
+            category="HTML reports"
+        ),
+        genome_dir = directory(
+            os.sep.join(["{sample}", config["params"]["segmenter"], "L2R",
+                         f"{{sample}}_solo.{config['params']['genome']}"])
+        )
+    message:
+        "Running the complete EaCoN analysis of {wildcards.sample}"
+    threads: 1
+    #conda:
+    #    "env/eacon_dependencies.yaml"
+    resources:
+        in_flight = 1,
+        mem_mb = predicted(
+            "EaCoN_sample", "mem_mb",
+            lambda wildcards, attempt: min(attempt * 4096 + 6144, 10240)
+        ),
+        time_min = predicted(
+            "EaCoN_sample", "time_min",
+            lambda wildcards, attempt: min(attempt * 210, 600)
+        )
+    priority:
+        step_priority("EaCoN_sample")
+    wildcard_constraints:
+        sample = r"[^/]+"
+    benchmark:
+        "benchmarks/EaCoN_sample/{sample}.tsv"
+    log:
+        "logs/EaCoN/{sample}_sample.log"
+    script:
+        "../scripts/EaCoN_sample.R"
@@ -0,0 +1,55 @@
+"""
+This rule scores the genomic instability of finished samples in a
+single local job, instead of one EaCoN_GIS cluster job per sample. A
+sample is finished when its gammaEval.txt and Cut.cbs exist as the run
+starts: failed samples do not hold back the others, and samples
+finishing during a run are scored by the next one. It writes per-sample
+{sample}_cohort_GIS.tsv files and a cohort summary table.
+"""
+localrules: cohort_GIS
+
+
+rule cohort_GIS:
+    input:
+        gama_eval_txt = expand(
+            os.sep.join([
+                "{sample}", config["params"]["segmenter"],
+                "ASCN", "{sample}.gammaEval.txt"
+            ]),
+            sample=gis_sample_list
+        ),
+        cut = expand(
+            os.sep.join([
+                "{sample}", config["params"]["segmenter"], "L2R",
+                "{sample}.Cut.cbs"
+            ]),
+            sample=gis_sample_list
+        )
+    output:
+        samples = expand(
+            "{sample}/{sample}_cohort_GIS.tsv",
+            sample=gis_sample_list
+        ),
+        summary = "instability/cohort_GIS.tsv"
+    message:
+        "Scoring instability of {} samples".format(len(gis_sample_list))
+    threads: 1
+    conda:
+        "../envs/segment_store.yaml"
+    params:
+        files = "logs/instability/files.tsv",
+        samples = gis_sample_list,
+        segmenter = config["params"]["segmenter"],
+        script = op.join(config["params"]["scripts"], "instability.py")
+    log:
+        "logs/instability/cohort_GIS.log"
+    shell:
+        "mkdir --parents $(dirname {params.files}) && "
+        "for sample in {params.samples}; do "
+        "printf '%s\\t%s\\t%s\\t%s\\n' \"${{sample}}\" "
+        "\"${{sample}}/{params.segmenter}/ASCN/${{sample}}.gammaEval.txt\" "
+        "\"${{sample}}/{params.segmenter}/L2R/${{sample}}.Cut.cbs\" "
+        "\"${{sample}}/${{sample}}_cohort_GIS.tsv\"; "
+        "done > {params.files} && "
+        "python3 {params.script} --manifest {params.files} "
+        "--summary {output.summary} > {log} 2>&1"
@@ -0,0 +1,63 @@
+"""
+This rule renders segmentation plots of all samples from their segment
+files, with one process per thread across samples and chromosomes. It
+does not need the RDS objects, so it runs right after segmentation and
+uses little memory. With `segment_plots: lazy`, only genome-wide plots
+are rendered; per-chromosome plots are rendered on demand with:
+`scripts/plot_segments.py chromosome {sample}/.../{sample}.Cut.cbs chr7`
+"""
+rule segment_plots:
+    input:
+        expand(
+            os.sep.join([
+                "{sample}", config["params"]["segmenter"], "L2R",
+                "{sample}.{ext}"
+            ]),
+            sample=sample_id_list,
+            ext=["Cut.cbs", "NoCut.cbs", "SegmentedBAF.txt"]
+        )
+    output:
+        genome = expand(
+            "plots/{sample}/{sample}.L2R.G.png", sample=sample_id_list
+        ),
+        chromosomes = expand(
+            "plots/{sample}/chromosomes/{chr}.png",
+            sample=(
+                sample_id_list
+                if config.get("segment_plots") != "lazy" else []
+            ),
+            chr=[f"chr{i}" for i in list(map(str, range(1, 23))) + ["X", "Y"]]
+        )
+    message:
+        "Rendering segmentation plots of {} samples".format(
+            len(sample_id_list)
+        )
+    threads: min(config.get("plot_threads", 4), 16)
+    resources:
+        mem_mb = (
+            lambda wildcards, threads, attempt: min(
+                attempt * 512 * threads + 1024, 32768
+            )
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(attempt * 60, 360)
+        )
+    conda:
+        "../envs/segment_plots.yaml"
+    params:
+        files = "logs/segment_plots/files.tsv",
+        samples = sample_id_list,
+        segmenter = config["params"]["segmenter"],
+        lazy = "--lazy" if config.get("segment_plots") == "lazy" else "",
+        script = op.join(config["params"]["scripts"], "plot_segments.py")
+    log:
+        "logs/segment_plots/render.log"
+    shell:
+        "mkdir --parents $(dirname {params.files}) && "
+        "for sample in {params.samples}; do "
+        "printf '%s\\t%s\\n' \"${{sample}}\" "
+        "\"${{sample}}/{params.segmenter}/L2R/${{sample}}.Cut.cbs\"; "
+        "done > {params.files} && "
+        "python3 {params.script} --output plots cohort "
+        "--manifest {params.files} --threads {threads} {params.lazy} "
+        "> {log} 2>&1"
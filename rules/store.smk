@@ -0,0 +1,46 @@
+"""
+This rule gathers segments, allele-specific segments and instability
+scores of all samples in a cohort Parquet store, partitioned by result
+kind and chromosome. New samples are appended to the existing store:
+only changed results cause their kind to be rewritten. Query the store
+with `scripts/segment_store.py region` or `scripts/segment_store.py matrix`.
+"""
+rule segment_store:
+    input:
+        expand(
+            os.sep.join([
+                "{sample}", config["params"]["segmenter"], "L2R",
+                "{sample}.{ext}"
+            ]),
+            sample=sample_id_list,
+            ext=["Cut.cbs", "NoCut.cbs", "SegmentedBAF.txt", "Cut.acbs",
+                 "Instab.txt"]
+        )
+    output:
+        "segment_store/index.json"
+    message:
+        "Gathering segments of {} samples".format(len(sample_id_list))
+    threads: 1
+    resources:
+        mem_mb = (
+            lambda wildcards, attempt: min(attempt * 4096, 16384)
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(attempt * 60, 360)
+        )
+    conda:
+        "../envs/segment_store.yaml"
+    params:
+        files = "logs/segment_store/files.tsv",
+        store = "segment_store",
+        script = op.join(config["params"]["scripts"], "segment_store.py")
+    log:
+        "logs/segment_store/build.log"
+    shell:
+        # Paths look like {sample}/{segmenter}/L2R/{sample}.{ext}
+        "mkdir --parents $(dirname {params.files}) && "
+        "for path in {input}; do "
+        "printf '%s\\t%s\\n' \"${{path%%/*}}\" \"${{path}}\"; "
+        "done > {params.files} && "
+        "python3 {params.script} --store {params.store} build "
+        "--manifest {params.files} > {log} 2>&1"
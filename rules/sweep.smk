@@ -0,0 +1,95 @@
+"""
+These rules explore a grid of segmentation parameters, given as lists
+under `sweep` in the configuration file. Each combination is segmented
+and modelled in its own sweep/{combo}/ subtree, and all combinations of
+a sample reuse its single normalised _processed.RDS file.
+"""
+
+
+"""
+This rule performs segmentation with one combination of parameters
+"""
+rule EaCoN_sweep_segment:
+    input:
+        rds = os.path.join(
+            "{sample}",
+            "{}_{}_{}_processed.RDS".format(
+                "{sample}",
+                config['params']['arraytype'],
+                config['params']['genome']
+            )
+        )
+    output:
+        files = expand(
+            os.sep.join([
+                "sweep", "{combo}", "{sample}", config["params"]["segmenter"],
+                "L2R", "{sample}.{ext}"
+            ]),
+            combo="{combo}",
+            sample="{sample}",
+            ext=["Cut.cbs", "NoCut.cbs", "Rorschach.png", "SegmentedBAF.txt"]
+        ),
+        seg_rds = os.sep.join([
+            "sweep", "{combo}", "{sample}", config["params"]["segmenter"],
+            "L2R", f"{{sample}}.SEG.{config['params']['segmenter']}.RDS"
+        ])
+    message:
+        "Segmentation of {wildcards.sample} with {wildcards.combo}"
+    threads: 1
+    resources:
+        mem_mb = (
+            lambda wildcards, attempt: min(attempt * 4096, 5120)
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(attempt * 60, 180)
+        )
+    params:
+        segmentation = lambda wildcards: sweep_dict[wildcards.combo],
+        out_dir = lambda wildcards: os.sep.join([
+            "sweep", wildcards.combo, wildcards.sample
+        ])
+    wildcard_constraints:
+        sample = r"[^/]+",
+        combo = r"[^/]+"
+    log:
+        "logs/EaCoN/sweep/{combo}/{sample}_Segmentation.log"
+    script:
+        "../scripts/EaCoN_segment.R"
+
+
+"""
+This rule builds copy number models for one combination of parameters
+"""
+rule EaCoN_sweep_ascn:
+    input:
+        rds = os.sep.join([
+            "sweep", "{combo}", "{sample}", config["params"]["segmenter"],
+            "L2R", f"{{sample}}.SEG.{config['params']['segmenter']}.RDS"
+        ])
+    output:
+        gama_eval_png = os.sep.join([
+            "sweep", "{combo}", "{sample}", config["params"]["segmenter"],
+            "ASCN", "{sample}.gammaEval.png"
+        ]),
+        gama_eval_txt = os.sep.join([
+            "sweep", "{combo}", "{sample}", config["params"]["segmenter"],
+            "ASCN", "{sample}.gammaEval.txt"
+        ])
+    message:
+        "Building copy number models for {wildcards.sample} "
+        "with {wildcards.combo}"
+    threads: 1
+    resources:
+        mem_mb = (
+            lambda wildcards, attempt: min(attempt * 4096, 5120)
+        ),
+        time_min = (
+            lambda wildcards, attempt: min(attempt * 45, 180)
+        )
+    wildcard_constraints:
+        sample = r"[^/]+",
+        combo = r"[^/]+"
+    log:
+        "logs/EaCoN/sweep/{combo}/{sample}_ascn.log"
+    script:
+        "../scripts/EaCoN_ascn.R"
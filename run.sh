@@ -6,7 +6,8 @@ declare -x PROFILE="/mnt/beegfs/pipelines/cel-cnv-eacon/pipeline/cel-cnv-eacon/.
 declare -x PIPELINE_PATH="/mnt/beegfs/pipelines/cel-cnv-eacon/pipeline/cel-cnv-eacon"
 declare -x ENV_PATH="/mnt/beegfs/pipelines/rna-count-salmon/env"
 declare -x SNAKEMAKE_OUTPUT_CACHE="/mnt/beegfs/pipelines/cel-cnv-eacon/cache/"
-export LDB_PATH PROFILE PIPELINE_PATH ENV_PATH SNAKEMAKE_OUTPUT_CACHE
+declare -x RESOURCE_HISTORY="/mnt/beegfs/pipelines/cel-cnv-eacon/resources/history.tsv"
+export LDB_PATH PROFILE PIPELINE_PATH ENV_PATH SNAKEMAKE_OUTPUT_CACHE RESOURCE_HISTORY
 
 # This function only changes echo headers
 # for user's sake.
@@ -69,6 +70,8 @@ function help_message() {
   echo ""
   message DOC "I understand very fiew things, and here they are:"
   message DOC "-h | --help        Print this help message, then exit."
+  message DOC "-w | --watch       Process CEL files as they land in the current"
+  message DOC "                   directory, until interrupted."
   message DOC "Otherwise, run me without any arguments and I'll do magic."
   echo ""
   message DOC "I have error codes and here are their meaning:"
@@ -94,7 +97,7 @@ function prepare_design() {
 }
 
 function prepare_config() {
-    python3 "${PIPELINE_PATH:?}/scripts/prepare_config.py" -r "${PWD}" --ldb "${LDB_PATH:?}" --threads 100  && message INFO "Configuration file built" || error_handling "${LINENO}" 4 "Could not create configuration yaml file"
+    python3 "${PIPELINE_PATH:?}/scripts/prepare_config.py" -r "${PWD}" --ldb "${LDB_PATH:?}" --threads 100 --resource_history "${RESOURCE_HISTORY:?}" && message INFO "Configuration file built" || error_handling "${LINENO}" 4 "Could not create configuration yaml file"
 }
 
 function upload() {
@@ -108,7 +111,13 @@ function upload() {
 
 
 
-[[ $# -gt 0 ]] && help_message
+WATCH=false
+while [[ $# -gt 0 ]]; do
+  case "${1}" in
+    -w|--watch) WATCH=true; shift;;
+    *) help_message;;
+  esac
+done
 
 CONDA='conda'
 CONDA_VERSION="$(conda --version)"
@@ -133,6 +142,13 @@ else
 
   # Building multiple configurations files
   [ -f cold_storage.yaml ] && message INFO "Cold storage mounting points already provided." || prepare_cold_storage
+  if [ "${WATCH}" = true ]; then
+    type grd &> /dev/null && message INFO "Environment suitable" || error_handling "${LINENO}" 5 "grd was not available in path"
+    message INFO "Watching ${PWD} for new CEL files, interrupt me to stop."
+    python3 "${PIPELINE_PATH:?}/scripts/watch_folder.py" -r "${PWD}" --design design.tsv --configfile config.yaml --prepare "python3 ${PIPELINE_PATH:?}/scripts/prepare_config.py -r ${PWD} --ldb ${LDB_PATH:?} --threads 100 --resource_history ${RESOURCE_HISTORY:?}" -- snakemake -s "${PIPELINE_PATH:?}/Snakefile" --configfile config.yaml --profile "${PROFILE:?}" && message INFO "Watch over!" || error_handling "${LINENO}" 6 "Failed with watch process"
+    message INFO "Process over"
+    exit 0
+  fi
   [ -f design.tsv ] && message INFO "Design file already provided." || prepare_design
   [ -f config.yaml ] && message INFO "Configuration file already provided." || prepare_config
 
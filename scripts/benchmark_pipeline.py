@@ -0,0 +1,317 @@
+#!/usr/bin/python3.7
+# -*- coding: utf-8 -*-
+
+"""
+This script measures the pipeline on a single machine, without Slurm.
+It builds a cohort of CEL files, runs the design and configuration
+preparation, the CEL staging and, when real CEL files are given as
+templates, every EaCoN rule. Wall time, CPU time and peak memory of each
+stage and rule are written in a JSON report, comparable across commits.
+"""
+
+import csv                           # Parse benchmark files
+import glob                          # Find benchmark files
+import json                          # Write report
+import os                            # Paths and os functions
+import platform                      # Host description
+import struct                        # Write binary CEL headers
+import subprocess                    # Run stages
+import sys                           # System related methods
+import time                          # Wall time
+from argparse import ArgumentParser  # Parse command line
+from pathlib import Path             # Paths related methods
+from typing import Any, Dict, List, Optional
+
+SCRIPTS = Path(__file__).absolute().parent
+PIPELINE = SCRIPTS.parent
+CHUNK = 1024 * 1024
+
+
+def calvin_string(value: str, wide: bool = False) -> bytes:
+    """
+    Encode a length-prefixed Calvin string
+    """
+    data = value.encode("utf-16-be" if wide else "ascii")
+    return struct.pack(">i", len(value)) + data
+
+
+def calvin_header(params: Dict[str, str]) -> bytes:
+    """
+    Build a Calvin file header holding the given text parameters
+    """
+    header = (
+        bytes([59, 1]) + struct.pack(">iI", 1, 0)
+        + calvin_string("affymetrix-calvin-intensity")
+        + calvin_string("synthetic")
+        + calvin_string("", wide=True)
+        + calvin_string("en-US", wide=True)
+        + struct.pack(">i", len(params))
+    )
+    for name, value in params.items():
+        encoded = value.encode("utf-16-be")
+        header += (
+            calvin_string(name, wide=True)
+            + struct.pack(">i", len(encoded)) + encoded
+            + calvin_string("text/x-calvin-unicode-text", wide=True)
+        )
+    return header + struct.pack(">i", 0)
+
+
+def write_synthetic_cel(path: Path, params: Dict[str, str], size_mb: float,
+                        block: bytes) -> None:
+    """
+    Write a CEL-shaped file: a valid Calvin header, then random bytes
+    """
+    with path.open("wb") as cel:
+        cel.write(calvin_header(params))
+        remaining = int(size_mb * CHUNK)
+        while remaining > 0:
+            cel.write(block[:remaining])
+            remaining -= len(block)
+
+
+def synthetic_cohort(raw_data: Path, array_type: str, samples: int,
+                     size_mb: float) -> None:
+    """
+    Write a cohort of synthetic CytoScan or OncoScan CEL files
+    """
+    block = os.urandom(CHUNK)
+    for index in range(samples):
+        sample = f"S{index:04d}"
+        if array_type == "CytoScanHD_Array":
+            write_synthetic_cel(raw_data / f"{sample}.CEL", {
+                "affymetrix-array-type": array_type,
+                "affymetrix-array-barcode": f"CY{index:08d}"
+            }, size_mb, block)
+            continue
+        for channel, dye in (("A", "AT"), ("C", "GC")):
+            write_synthetic_cel(raw_data / f"{sample}_{channel}.CEL", {
+                "affymetrix-array-type": array_type,
+                "affymetrix-array-barcode": f"ON{index:08d}",
+                "affymetrix-dye": dye
+            }, size_mb / 2, block)
+
+
+def template_cohort(raw_data: Path, templates: List[str],
+                    samples: int) -> None:
+    """
+    Build a cohort of real CEL files by linking the templates: a CytoScan
+    CEL file, or the A and C channels of an OncoScan array
+    """
+    for index in range(samples):
+        sample = f"S{index:04d}"
+        for template in templates:
+            suffix = template[-len("_A.CEL"):]
+            name = (
+                f"{sample}{suffix}" if suffix in ("_A.CEL", "_C.CEL")
+                else f"{sample}.CEL"
+            )
+            try:
+                os.link(template, raw_data / name)
+            except OSError:
+                os.symlink(os.path.realpath(template), raw_data / name)
+
+
+def measure(name: str, cmd: List[str], cwd: Path, log: Path) -> Dict[str, Any]:
+    """
+    Run a stage and return its wall time, CPU time and peak memory
+    """
+    with log.open("a") as log_file:
+        log_file.write(f"# {name}: {' '.join(cmd)}\n")
+        log_file.flush()
+        start = time.time()
+        process = subprocess.Popen(
+            cmd, cwd=cwd, stdout=log_file, stderr=subprocess.STDOUT
+        )
+        _, status, usage = os.wait4(process.pid, 0)
+    return {
+        "stage": name,
+        "returncode": status >> 8 if os.WIFEXITED(status) else -1,
+        "wall_s": round(time.time() - start, 3),
+        "cpu_s": round(usage.ru_utime + usage.ru_stime, 3),
+        "max_rss_mb": round(usage.ru_maxrss / 1024, 1)
+    }
+
+
+def rule_benchmarks(workdir: Path) -> List[Dict[str, Any]]:
+    """
+    Summarize the Snakemake benchmark files of each rule
+    """
+    rules = {}
+    for path in sorted(glob.glob(str(workdir / "benchmarks" / "*" / "*.tsv"))):
+        with open(path) as benchmark:
+            rows = list(csv.DictReader(benchmark, delimiter="\t"))
+        rule = rules.setdefault(Path(path).parent.name, {
+            "rule": Path(path).parent.name,
+            "jobs": 0, "wall_s": 0.0, "wall_s_max": 0.0,
+            "cpu_s": 0.0, "max_rss_mb": 0.0
+        })
+        for row in rows:
+            rule["jobs"] += 1
+            rule["wall_s"] += float(row["s"])
+            rule["wall_s_max"] = max(rule["wall_s_max"], float(row["s"]))
+            for column, key, reduce in (("cpu_time", "cpu_s", sum),
+                                        ("max_rss", "max_rss_mb", max)):
+                try:
+                    rule[key] = reduce([rule[key], float(row[column])])
+                except (KeyError, ValueError):
+                    # Short jobs and older Snakemake do not report these
+                    pass
+    return list(rules.values())
+
+
+def git_commit() -> Optional[str]:
+    """
+    Return the commit of the benchmarked pipeline, if available
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "-C", str(PIPELINE), "rev-parse", "HEAD"],
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    main_parser = ArgumentParser(
+        description="Benchmark the pipeline locally on a synthetic cohort",
+        epilog="Synthetic CEL files only have realistic headers and sizes: "
+               "EaCoN rules are run only when real CEL files are given "
+               "with --template."
+    )
+
+    main_parser.add_argument(
+        "-o", "--output",
+        help="Path to the benchmark working directory (default: %(default)s)",
+        type=str,
+        default="eacon_benchmark"
+    )
+
+    main_parser.add_argument(
+        "-n", "--samples",
+        help="Number of samples in the cohort (default: %(default)s)",
+        type=int,
+        default=10
+    )
+
+    main_parser.add_argument(
+        "-a", "--array-type",
+        help="Array type of synthetic CEL files (default: %(default)s)",
+        choices=["CytoScanHD_Array", "OncoScan_CNV"],
+        default="CytoScanHD_Array"
+    )
+
+    main_parser.add_argument(
+        "--cel-mb",
+        help="Size of each synthetic sample, in MB (default: %(default)s)",
+        type=float,
+        default=64
+    )
+
+    main_parser.add_argument(
+        "--template",
+        help="Real CEL file(s) copied into the cohort: one CytoScan CEL, "
+             "or both _A.CEL and _C.CEL channels of an OncoScan array",
+        type=str,
+        nargs="+",
+        default=None
+    )
+
+    main_parser.add_argument(
+        "-c", "--cores",
+        help="Number of cores given to each stage (default: %(default)s)",
+        type=int,
+        default=os.cpu_count()
+    )
+
+    main_parser.add_argument(
+        "--ldb",
+        help="Path to ldb, required to run EaCoN rules "
+             "(default: the LDB_PATH environment variable)",
+        type=str,
+        default=os.environ.get("LDB_PATH")
+    )
+
+    main_parser.add_argument(
+        "-r", "--report",
+        help="Path to the JSON report (default: %(default)s)",
+        type=str,
+        default="benchmark_report.json"
+    )
+
+    args = main_parser.parse_args()
+    if not args.ldb:
+        main_parser.error("--ldb is required when LDB_PATH is not set")
+    workdir = Path(args.output).absolute()
+    raw_data = workdir / "cold"
+    raw_data.mkdir(parents=True, exist_ok=False)
+    if args.template is not None:
+        template_cohort(raw_data, args.template, args.samples)
+    else:
+        synthetic_cohort(raw_data, args.array_type, args.samples, args.cel_mb)
+
+    python = sys.executable
+    log = workdir / "benchmark.log"
+    stages = [
+        ("scan", [
+            python, str(SCRIPTS / "raw_scanner.py"), "-r", str(raw_data),
+            "--no-cache"
+        ]),
+        ("design", [
+            python, str(SCRIPTS / "prepare_design.py"), "-r", str(raw_data),
+            "-d", "design.tsv", "--no-cache"
+        ]),
+        ("cold_storage", [
+            python, str(SCRIPTS / "prepare_cold_storage.py"),
+            "--path", str(raw_data), "-o", "cold_storage.yaml"
+        ]),
+        ("config", [
+            python, str(SCRIPTS / "prepare_config.py"), "-r", str(raw_data),
+            "-w", str(workdir), "-d", "design.tsv",
+            "--coldstorage", "cold_storage.yaml", "--ldb", args.ldb,
+            "--threads", str(args.cores), "--stage_workers", str(args.cores)
+        ]),
+        ("stage", [
+            python, str(SCRIPTS / "stage_cel.py"), "-m", "transfers.tsv",
+            "-o", "raw_data/manifest.tsv", "-w", str(args.cores),
+            "-c", str(raw_data)
+        ])
+    ]
+    if args.template is not None:
+        stages.append(("pipeline", [
+            "snakemake", "--snakefile", str(PIPELINE / "Snakefile"),
+            "--configfile", "config.yaml", "--cores", str(args.cores),
+            "--forceall", "--keep-going"
+        ]))
+
+    with (workdir / "transfers.tsv").open("w") as transfers:
+        for cel in sorted(raw_data.iterdir()):
+            transfers.write(f"{cel}\traw_data/{cel.name}\n")
+
+    results = []
+    for name, cmd in stages:
+        results.append(measure(name, cmd, workdir, log))
+        print(f"{name}: {results[-1]['wall_s']}s", file=sys.stderr)
+        if results[-1]["returncode"] != 0:
+            print(f"{name} failed, see {log}", file=sys.stderr)
+            break
+
+    report = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "cpus": os.cpu_count(),
+        "cores": args.cores,
+        "samples": args.samples,
+        "array_type": (
+            "template" if args.template is not None else args.array_type
+        ),
+        "cohort_mb": round(sum(
+            cel.stat().st_size for cel in raw_data.iterdir()
+        ) / CHUNK, 1),
+        "stages": results,
+        "rules": rule_benchmarks(workdir)
+    }
+    with open(args.report, "w") as report_file:
+        json.dump(report, report_file, indent=2)
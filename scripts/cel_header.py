@@ -0,0 +1,204 @@
+#!/usr/bin/python3.7
+# -*- coding: utf-8 -*-
+
+"""
+This module reads the headers of CEL files without reading the files:
+only the first kilobytes are memory-mapped. Command Console (Calvin),
+XDA binary and text CEL formats are understood.
+"""
+
+import json                                   # Print headers
+import mmap                                   # Partial file reads
+import os                                     # Paths and os functions
+import re                                     # Parse text headers
+import struct                                 # Parse binary headers
+import sys                                    # System related methods
+from argparse import ArgumentParser           # Parse command line
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+HEADER_SIZE = 64 * 1024
+CALVIN_MAGIC = 59
+XDA_MAGIC = 64
+CHANNEL_KEYS = (
+    "affymetrix-channel", "affymetrix-array-channel", "affymetrix-dye"
+)
+
+
+def read_int(data: bytes, offset: int) -> Tuple[int, int]:
+    """
+    Read a big endian 32 bits integer
+    """
+    return struct.unpack_from(">i", data, offset)[0], offset + 4
+
+
+def read_string(data: bytes, offset: int) -> Tuple[bytes, int]:
+    """
+    Read a length-prefixed byte string
+    """
+    length, offset = read_int(data, offset)
+    if length < 0 or offset + length > len(data):
+        raise struct.error("String out of the mapped header")
+    return data[offset:offset + length], offset + length
+
+
+def read_wstring(data: bytes, offset: int) -> Tuple[str, int]:
+    """
+    Read a length-prefixed UTF-16 string
+    """
+    length, offset = read_int(data, offset)
+    if length < 0 or offset + 2 * length > len(data):
+        raise struct.error("String out of the mapped header")
+    text = data[offset:offset + 2 * length].decode("utf-16-be", "replace")
+    return text.rstrip("\x00"), offset + 2 * length
+
+
+def calvin_value(value: bytes, mime: str) -> str:
+    """
+    Decode a Calvin parameter value according to its mime type
+    """
+    if mime == "text/x-calvin-unicode-text":
+        return value.decode("utf-16-be", "replace").rstrip("\x00")
+    if mime in ("text/ascii", "text/plain"):
+        return value.decode("ascii", "replace").rstrip("\x00")
+    if mime == "text/x-calvin-integer-32" and len(value) >= 4:
+        return str(struct.unpack(">i", value[:4])[0])
+    if mime == "text/x-calvin-float" and len(value) >= 4:
+        return str(struct.unpack(">f", value[:4])[0])
+    return ""
+
+
+def read_calvin_header(data: bytes,
+                       offset: int,
+                       params: Dict[str, str]) -> int:
+    """
+    Gather parameters of a Calvin generic data header and of its parents.
+    Parameters of the header win over the ones of its parents.
+    """
+    _, offset = read_string(data, offset)   # Data type identifier
+    _, offset = read_string(data, offset)   # File identifier
+    _, offset = read_wstring(data, offset)  # Creation time
+    _, offset = read_wstring(data, offset)  # Locale
+    count, offset = read_int(data, offset)
+    for _ in range(count):
+        name, offset = read_wstring(data, offset)
+        value, offset = read_string(data, offset)
+        mime, offset = read_wstring(data, offset)
+        params.setdefault(name, calvin_value(value, mime))
+    parents, offset = read_int(data, offset)
+    for _ in range(parents):
+        parent = {}
+        offset = read_calvin_header(data, offset, parent)
+        for name, value in parent.items():
+            params.setdefault(name, value)
+    return offset
+
+
+def parse_calvin(data: bytes) -> Dict[str, Optional[str]]:
+    """
+    Extract chip type, channel, barcode and scan date of a Calvin CEL file
+    """
+    params = {}
+    try:
+        read_calvin_header(data, 10, params)
+    except struct.error:
+        # Header larger than the mapped area: keep what was read
+        pass
+    return {
+        "format": "calvin",
+        "chip_type": params.get("affymetrix-array-type") or None,
+        "channel": next(
+            (params[key] for key in CHANNEL_KEYS if params.get(key)), None
+        ),
+        "barcode": params.get("affymetrix-array-barcode") or None,
+        "scan_date": params.get("affymetrix-scan-date") or None
+    }
+
+
+def parse_dat_header(text: str, file_format: str) -> Dict[str, Optional[str]]:
+    """
+    Extract chip type and scan date from a DatHeader line
+    """
+    chip_type = re.search(r"(\S+)\.1sq", text)
+    scan_date = re.search(r"\d\d/\d\d/\d\d\s+\d\d:\d\d:\d\d", text)
+    return {
+        "format": file_format,
+        "chip_type": chip_type.group(1) if chip_type else None,
+        "channel": None,
+        "barcode": None,
+        "scan_date": scan_date.group(0) if scan_date else None
+    }
+
+
+def parse_xda(data: bytes) -> Dict[str, Optional[str]]:
+    """
+    Extract chip type and scan date of an XDA binary CEL file
+    """
+    length = struct.unpack_from("<i", data, 20)[0]
+    text = data[24:24 + max(length, 0)].decode("ascii", "replace")
+    return parse_dat_header(text, "xda")
+
+
+def read_header(path: str) -> Dict[str, Optional[str]]:
+    """
+    Return the chip type, channel, barcode and scan date of a CEL file.
+    Unknown formats and unreadable files have no chip type.
+    """
+    header = {
+        "format": None,
+        "chip_type": None,
+        "channel": None,
+        "barcode": None,
+        "scan_date": None
+    }
+    try:
+        with open(path, "rb") as stream:
+            size = os.fstat(stream.fileno()).st_size
+            if size < 24:
+                return header
+            with mmap.mmap(stream.fileno(),
+                           min(size, HEADER_SIZE),
+                           access=mmap.ACCESS_READ) as data:
+                if data[0] == CALVIN_MAGIC and data[1] == 1:
+                    return parse_calvin(data[:])
+                if struct.unpack_from("<i", data, 0)[0] == XDA_MAGIC:
+                    return parse_xda(data)
+                if data[:5] == b"[CEL]":
+                    text = data[:].decode("ascii", "replace")
+                    return parse_dat_header(text, "text")
+    except (OSError, ValueError, struct.error):
+        pass
+    return header
+
+
+def read_headers(paths: List[str],
+                 workers: int = 16) -> Dict[str, Dict[str, Optional[str]]]:
+    """
+    Read the headers of many CEL files concurrently
+    """
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        return dict(zip(paths, pool.map(read_header, paths)))
+
+
+if __name__ == '__main__':
+    main_parser = ArgumentParser(
+        description="Print chip type, channel, barcode and scan date of "
+                    "CEL files as JSON",
+    )
+
+    main_parser.add_argument(
+        "cel",
+        help="Space separated list of CEL files",
+        type=str,
+        nargs="+"
+    )
+
+    main_parser.add_argument(
+        "-w", "--workers",
+        help="Number of files read concurrently (default: %(default)s)",
+        type=int,
+        default=16
+    )
+
+    args = main_parser.parse_args()
+    json.dump(read_headers(args.cel, args.workers), sys.stdout, indent=2)
@@ -0,0 +1,263 @@
+#!/usr/bin/python3.7
+# -*- coding: utf-8 -*-
+
+"""
+This script restores or stores the outputs of an EaCoN step in a shared,
+content-addressed cache. Entries are keyed on the checksum of the sample
+CEL file(s), the rule, the sample name and the parameters of the step.
+The total size of the cache is kept in an index updated on each store,
+so that entries are only listed when the cache has to be evicted.
+"""
+
+import fcntl                         # Lock the size index
+import hashlib                       # Checksums
+import json                          # Stable parameters serialisation
+import os                            # Paths and os functions
+import shutil                        # File copies
+import sys                           # System related methods
+from argparse import ArgumentParser  # Parse command line
+from pathlib import Path             # Paths related methods
+from typing import Dict, List, Tuple
+
+CHUNK = 8 * 1024 * 1024
+SIZE_INDEX = "size.json"
+
+
+def cel_digest(cache: Path, cel: str) -> str:
+    """
+    Return the md5 checksum of a CEL file. Checksums are remembered in the
+    cache, keyed on path, size and modification time.
+    """
+    stat = os.stat(cel)
+    memo_key = hashlib.sha1(
+        f"{os.path.realpath(cel)}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+    ).hexdigest()
+    memo = cache / "digests" / memo_key
+    if memo.exists():
+        return memo.read_text().strip()
+
+    digest = hashlib.md5()
+    with open(cel, "rb") as stream:
+        for chunk in iter(lambda: stream.read(CHUNK), b""):
+            digest.update(chunk)
+    memo.parent.mkdir(parents=True, exist_ok=True)
+    memo.write_text(digest.hexdigest())
+    return digest.hexdigest()
+
+
+def entry_key(cache: Path,
+              rule: str,
+              sample: str,
+              cels: List[str],
+              params: Dict[str, str]) -> str:
+    """
+    Return the content address of a step's outputs
+    """
+    content = {
+        "rule": rule,
+        "sample": sample,
+        "cels": sorted(cel_digest(cache, cel) for cel in cels),
+        "params": params
+    }
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True).encode()
+    ).hexdigest()
+
+
+def copy_path(source: Path, destination: Path) -> None:
+    """
+    Copy a file or a directory, creating parent directories
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    if source.is_dir():
+        if destination.exists():
+            shutil.rmtree(destination)
+        shutil.copytree(source, destination)
+    else:
+        shutil.copy2(source, destination)
+
+
+def restore(entry: Path, outputs: List[str]) -> bool:
+    """
+    Copy cached outputs back in the working directory
+    """
+    if not (entry / ".complete").exists():
+        return False
+    if not all((entry / output).exists() for output in outputs):
+        return False
+    for output in outputs:
+        copy_path(entry / output, Path(output))
+    (entry / ".complete").touch()
+    return True
+
+
+def store(entry: Path, outputs: List[str]) -> int:
+    """
+    Copy outputs in a new cache entry, which becomes visible atomically.
+    The entry size is written in its completion marker, and returned when
+    the entry was added.
+    """
+    if (entry / ".complete").exists():
+        return 0
+    partial = entry.parent / f"{entry.name}.{os.getpid()}.tmp"
+    for output in outputs:
+        copy_path(Path(output), partial / output)
+    size = entry_size(partial)
+    (partial / ".complete").write_text(str(size))
+    try:
+        partial.rename(entry)
+    except OSError:
+        # Another job stored the very same entry in the meantime
+        shutil.rmtree(partial, ignore_errors=True)
+        return 0
+    return size
+
+
+def entry_size(entry: Path) -> int:
+    """
+    Return the disk usage of a cache entry, in bytes
+    """
+    return sum(
+        path.stat().st_size for path in entry.rglob("*") if path.is_file()
+    )
+
+
+def recorded_size(marker: Path) -> int:
+    """
+    Return the size written in the completion marker of an entry, or
+    measure entries stored without it
+    """
+    try:
+        return int(marker.read_text().strip())
+    except ValueError:
+        return entry_size(marker.parent)
+
+
+def list_entries(cache: Path) -> List[Tuple[float, Path, int]]:
+    """
+    Return the last use, path and size of every cache entry
+    """
+    return [
+        (marker.stat().st_mtime, marker.parent, recorded_size(marker))
+        for marker in cache.glob("*/*/.complete")
+    ]
+
+
+def add_size(cache: Path, size: int) -> int:
+    """
+    Add the size of a new entry to the size index, built from the entry
+    markers when missing, and return the total size of the cache
+    """
+    index = cache / SIZE_INDEX
+    with open(cache / f"{SIZE_INDEX}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            total = json.loads(index.read_text())["total"] + size
+        except (OSError, ValueError, KeyError):
+            total = sum(size for _, _, size in list_entries(cache))
+        partial = cache / f"{SIZE_INDEX}.{os.getpid()}.tmp"
+        partial.write_text(json.dumps({"total": total}))
+        os.replace(partial, index)
+    return total
+
+
+def evict(cache: Path, max_size: int) -> None:
+    """
+    Remove least recently used entries until the cache fits in max_size,
+    then reset the size index
+    """
+    with open(cache / f"{SIZE_INDEX}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        entries = list_entries(cache)
+        total = sum(size for _, _, size in entries)
+        for _, entry, size in sorted(entries):
+            if total <= max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+        partial = cache / f"{SIZE_INDEX}.{os.getpid()}.tmp"
+        partial.write_text(json.dumps({"total": total}))
+        os.replace(partial, cache / SIZE_INDEX)
+
+
+if __name__ == '__main__':
+    main_parser = ArgumentParser(
+        description="Restore or store the outputs of an EaCoN step",
+        epilog="Restore exits with status 1 when there is no cached result."
+    )
+
+    main_parser.add_argument(
+        "action",
+        help="What to do with the outputs",
+        choices=["restore", "store"]
+    )
+
+    main_parser.add_argument(
+        "--cache",
+        help="Path to the shared cache directory",
+        type=str,
+        required=True
+    )
+
+    main_parser.add_argument(
+        "--rule",
+        help="Name of the rule producing the outputs",
+        type=str,
+        required=True
+    )
+
+    main_parser.add_argument(
+        "--sample",
+        help="Sample identifier",
+        type=str,
+        required=True
+    )
+
+    main_parser.add_argument(
+        "--cel",
+        help="Space separated list of the sample CEL files",
+        type=str,
+        nargs="+",
+        required=True
+    )
+
+    main_parser.add_argument(
+        "--params",
+        help="Space separated list of key=value parameters of the step",
+        type=str,
+        nargs="*",
+        default=[]
+    )
+
+    main_parser.add_argument(
+        "--outputs",
+        help="Space separated list of the step outputs",
+        type=str,
+        nargs="+",
+        required=True
+    )
+
+    main_parser.add_argument(
+        "--max-size-gb",
+        help="Size of the cache after eviction (default: %(default)s)",
+        type=float,
+        default=100
+    )
+
+    args = main_parser.parse_args()
+    cache = Path(args.cache)
+    params = dict(param.split("=", 1) for param in args.params)
+    key = entry_key(cache, args.rule, args.sample, args.cel, params)
+    entry = cache / args.rule / key
+
+    if args.action == "restore":
+        restored = restore(entry, args.outputs)
+        print(f"{args.rule} {args.sample}: "
+              f"{'restored from' if restored else 'not found in'} {entry}",
+              file=sys.stderr)
+        sys.exit(0 if restored else 1)
+
+    max_size = int(args.max_size_gb * 1024 ** 3)
+    # Entries are only listed when the index says the cache is too large
+    if add_size(cache, store(entry, args.outputs)) > max_size:
+        evict(cache, max_size)
@@ -0,0 +1,193 @@
+#!/usr/bin/python3.7
+# -*- coding: utf-8 -*-
+
+"""
+This script annotates the segments of many samples with the genes they
+cover or truncate. Gene tables are loaded once in sorted NumPy arrays
+per chromosome, memory-mapped from a gene index or parsed from the ldb
+mirror, and overlaps are searched for all segments at once.
+"""
+
+import sys                           # System related methods
+from argparse import ArgumentParser  # Parse command line
+from pathlib import Path             # Paths related methods
+from typing import Dict, List, Tuple
+
+import numpy as np                   # Interval arrays
+import pandas as pd                  # Parse TSV files
+
+from gene_index import ROLES, GeneTable, load_index, load_tables
+from segment_store import read_segments
+
+
+def overlaps(table: GeneTable,
+             starts: np.ndarray,
+             ends: np.ndarray,
+             strict: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return (query index, gene index) pairs for all genes overlapping the
+    [start, end] queries. With strict, genes must strictly contain the
+    query, as for breakpoints.
+    """
+    first = np.searchsorted(
+        table["start"], starts - table["max_length"], side="left"
+    )
+    last = np.searchsorted(table["start"], ends, side="right")
+    counts = np.maximum(last - first, 0)
+    queries = np.repeat(np.arange(len(starts)), counts)
+    # Gene indices from first[q] to last[q] for each query q
+    offsets = np.arange(counts.sum()) - np.repeat(
+        np.cumsum(counts) - counts, counts
+    )
+    genes = np.repeat(first, counts) + offsets
+    if strict:
+        keep = (table["start"][genes] < starts[queries]) & (
+            table["end"][genes] > ends[queries]
+        )
+    else:
+        keep = table["end"][genes] >= starts[queries]
+    return queries[keep], genes[keep]
+
+
+def normalise_chromosomes(segments: pd.DataFrame) -> pd.DataFrame:
+    """
+    Name chromosomes 23 and 24 as X and Y
+    """
+    segments["chrom"] = segments["chrom"].replace(
+        {"chr23": "chrX", "chr24": "chrY"}
+    )
+    return segments
+
+
+def target_genes(tables: Dict[str, GeneTable],
+                 segments: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return genes overlapping gained or lost segments
+    """
+    altered = segments[segments["value"] != 0]
+    found = []
+    for chrom, chrom_segments in altered.groupby("chrom"):
+        if chrom not in tables:
+            continue
+        table = tables[chrom]
+        queries, genes = overlaps(
+            table, chrom_segments["start"].values, chrom_segments["end"].values
+        )
+        values = chrom_segments["value"].values[queries]
+        found.append(pd.DataFrame({
+            "Symbol": np.char.decode(table["symbol"][genes]),
+            "Chr": chrom,
+            "Start": table["start"][genes],
+            "End": table["end"][genes],
+            "Width": table["end"][genes] - table["start"][genes] + 1,
+            "Log2Ratio": values,
+            "Status": np.where(values > 0, "Gain", "Loss"),
+            "Cancer_role": ROLES[table["role"][genes]]
+        }))
+    return concat_genes(found, ["Chr", "Start", "Symbol"])
+
+
+def truncated_genes(tables: Dict[str, GeneTable],
+                    segments: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return genes containing a breakpoint between two adjacent segments
+    with different values
+    """
+    found = []
+    for chrom, chrom_segments in segments.groupby("chrom"):
+        if chrom not in tables:
+            continue
+        table = tables[chrom]
+        chrom_segments = chrom_segments.sort_values("start")
+        values = chrom_segments["value"].values
+        breakpoints = chrom_segments["end"].values[:-1][
+            values[1:] != values[:-1]
+        ]
+        queries, genes = overlaps(table, breakpoints, breakpoints, True)
+        found.append(pd.DataFrame({
+            "Symbol": np.char.decode(table["symbol"][genes]),
+            "Chr": chrom,
+            "Start": table["start"][genes],
+            "End": table["end"][genes],
+            "Width": table["end"][genes] - table["start"][genes] + 1,
+            "Breakpoint": breakpoints[queries],
+            "Cancer_role": ROLES[table["role"][genes]]
+        }))
+    return concat_genes(found, ["Chr", "Breakpoint", "Symbol"])
+
+
+def concat_genes(found: List[pd.DataFrame], order: List[str]) -> pd.DataFrame:
+    """
+    Gather per-chromosome annotations of a sample
+    """
+    found = [genes for genes in found if not genes.empty]
+    if not found:
+        return pd.DataFrame(columns=["Symbol", "Chr", "Start", "End"])
+    return pd.concat(found, ignore_index=True).sort_values(order)
+
+
+if __name__ == '__main__':
+    main_parser = ArgumentParser(
+        description="Annotate the segments of many samples with the genes "
+                    "they cover or truncate",
+    )
+
+    main_parser.add_argument(
+        "-m", "--manifest",
+        help="TSV file of sample and Cut.cbs paths",
+        type=str,
+        required=True
+    )
+
+    main_parser.add_argument(
+        "-i", "--index",
+        help="Path to a gene index built by gene_index.py",
+        type=str,
+        default=None
+    )
+
+    main_parser.add_argument(
+        "--ldb",
+        help="Path to ldb mirror of refGene, HGNC and COSMIC, parsed when "
+             "no index is given",
+        type=str,
+        default=None
+    )
+
+    main_parser.add_argument(
+        "-g", "--genome",
+        help="Genome version (default: %(default)s)",
+        type=str,
+        default="hg19"
+    )
+
+    main_parser.add_argument(
+        "-o", "--output",
+        help="Output directory (default: %(default)s)",
+        type=str,
+        default="annotation"
+    )
+
+    args = main_parser.parse_args()
+    if args.index is not None:
+        tables = load_index(args.index)
+    elif args.ldb is not None:
+        tables = load_tables(args.ldb, args.genome)
+    else:
+        main_parser.error("one of --index or --ldb is required")
+    print(f"Loaded {sum(len(t['start']) for t in tables.values())} gene "
+          "localisations", file=sys.stderr)
+
+    output = Path(args.output)
+    output.mkdir(parents=True, exist_ok=True)
+    with open(args.manifest) as manifest:
+        for line in manifest:
+            if not line.strip():
+                continue
+            sample, path = line.rstrip("\n").split("\t")[:2]
+            segments = normalise_chromosomes(read_segments(path, sample))
+            for name, genes in (("TargetGenes", target_genes),
+                                ("TruncatedGenes", truncated_genes)):
+                genes(tables, segments).to_csv(
+                    output / f"{sample}.{name}.txt", sep="\t", index=False
+                )
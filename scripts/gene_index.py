@@ -0,0 +1,290 @@
+#!/usr/bin/python3.7
+# -*- coding: utf-8 -*-
+
+"""
+This script converts the refGene, HGNC and COSMIC sources of the ldb
+mirror into a binary gene index, for one genome. The index is a single
+file: a JSON header followed by aligned arrays, which annotation jobs
+memory-map instead of parsing the text databases.
+"""
+
+import hashlib                       # Checksum database sources
+import json                          # Index header
+import os                            # Paths and os functions
+import re                            # Chromosome names
+import struct                        # Index header size
+import sys                           # System related methods
+from argparse import ArgumentParser  # Parse command line
+from typing import Any, Dict, List, Tuple
+
+import numpy as np                   # Interval arrays
+import pandas as pd                  # Parse TSV files
+
+MAIN_CHROMOSOMES = re.compile(r"^chr([0-9]+|X|Y)$")
+COSMIC_ROLES = {"oncogene": "onco", "TSG": "tsup", "oncogene/TSG": "mix"}
+ROLES = np.array(["", "census", "onco", "tsup", "mix"])
+MAGIC = b"EACONGIX"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+GeneTable = Dict[str, np.ndarray]
+
+
+def source_paths(ldb: str, genome: str) -> Dict[str, str]:
+    """
+    Return the paths to the ldb sources of a genome
+    """
+    return {
+        "refgene": os.path.join(ldb, "GoldenPath", genome, f"refGene.{genome}"),
+        "hgnc": os.path.join(ldb, "HGNC", "HGNC_Hugo.txt"),
+        "cosmic": os.path.join(
+            ldb, "COSMIC_cancer_census", "Census_all.tsv"
+        )
+    }
+
+
+def read_refgene(path: str, approved: List[str] = None) -> pd.DataFrame:
+    """
+    Read UCSC refGene transcripts on main chromosomes, and merge the
+    overlapping transcripts of each symbol, just like grd does
+    """
+    # Columns are: chrom (2), txStart (4), txEnd (5) and symbol (12)
+    genes = pd.read_csv(
+        path, sep="\t", header=None, comment="#", usecols=[2, 4, 5, 12],
+        dtype={2: str, 12: str}
+    )
+    genes.columns = ["chrom", "start", "end", "symbol"]
+    genes = genes[genes["chrom"].str.match(MAIN_CHROMOSOMES)]
+    if approved is not None:
+        genes = genes[genes["symbol"].isin(approved)]
+
+    genes = genes.sort_values(
+        ["symbol", "chrom", "start", "end"], ascending=[True, True, True, False]
+    )
+    reach = genes.groupby(["symbol", "chrom"])["end"].cummax()
+    previous = reach.groupby([genes["symbol"], genes["chrom"]]).shift()
+    cluster = (previous.isna() | (genes["start"] > previous)).cumsum()
+    return genes.groupby(cluster).agg(
+        symbol=("symbol", "first"),
+        chrom=("chrom", "first"),
+        start=("start", "min"),
+        end=("end", "max")
+    ).reset_index(drop=True)
+
+
+def read_approved_symbols(path: str) -> List[str]:
+    """
+    Read approved symbols from HGNC
+    """
+    hgnc = pd.read_csv(path, sep="\t", header=0, usecols=[1, 3], dtype=str)
+    return hgnc[hgnc.iloc[:, 1] == "Approved"].iloc[:, 0].tolist()
+
+
+def read_cosmic_roles(path: str) -> Dict[str, str]:
+    """
+    Read the role in cancer of COSMIC Gene Census genes
+    """
+    census = pd.read_csv(
+        path, sep="\t", header=None, usecols=[0, 12], dtype=str,
+        keep_default_na=False
+    )
+    return {
+        symbol: COSMIC_ROLES.get(role, "census")
+        for symbol, role in zip(census[0], census[12])
+    }
+
+
+def gene_tables(genes: pd.DataFrame,
+                roles: Dict[str, str]) -> Dict[str, GeneTable]:
+    """
+    Build per-chromosome gene arrays sorted by start. Symbols are ASCII
+    bytes and roles are indices in ROLES. The longest gene bounds the
+    search window of overlap queries.
+    """
+    codes = {role: code for code, role in enumerate(ROLES)}
+    tables = {}
+    for chrom, chrom_genes in genes.groupby("chrom"):
+        chrom_genes = chrom_genes.sort_values("start")
+        tables[chrom] = {
+            "start": chrom_genes["start"].values.astype(np.int64),
+            "end": chrom_genes["end"].values.astype(np.int64),
+            "symbol": chrom_genes["symbol"].values.astype(bytes),
+            "role": np.array(
+                [codes[roles.get(s, "")] for s in chrom_genes["symbol"]],
+                dtype=np.uint8
+            ),
+            "max_length": np.int64(
+                (chrom_genes["end"] - chrom_genes["start"]).max()
+            )
+        }
+    return tables
+
+
+def load_tables(ldb: str, genome: str) -> Dict[str, GeneTable]:
+    """
+    Parse refGene, HGNC and COSMIC tables from the ldb mirror
+    """
+    sources = source_paths(ldb, genome)
+    genes = read_refgene(
+        sources["refgene"],
+        read_approved_symbols(sources["hgnc"])
+        if os.path.exists(sources["hgnc"]) else None
+    )
+    roles = (
+        read_cosmic_roles(sources["cosmic"])
+        if os.path.exists(sources["cosmic"]) else {}
+    )
+    return gene_tables(genes, roles)
+
+
+def checksum(path: str) -> str:
+    """
+    Return the sha256 of a file, read by chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_index(path: str,
+                tables: Dict[str, GeneTable],
+                metadata: Dict[str, Any]) -> None:
+    """
+    Concatenate per-chromosome tables and write them after a JSON header.
+    Each array starts on an aligned offset, so it can be memory-mapped.
+    """
+    chromosomes = sorted(tables, key=chromosome_order)
+    arrays = {
+        name: np.concatenate([tables[chrom][name] for chrom in chromosomes])
+        for name in ("start", "end", "symbol", "role")
+    }
+    rows, first = {}, 0
+    for chrom in chromosomes:
+        count = len(tables[chrom]["start"])
+        rows[chrom] = {
+            "first": first,
+            "last": first + count,
+            "max_length": int(tables[chrom]["max_length"])
+        }
+        first += count
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "chromosomes": rows,
+        "roles": ROLES.tolist(),
+        "arrays": {},
+        **metadata
+    }
+    # Offsets are relative to the first aligned byte after the header
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset
+        }
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    encoded = json.dumps(header).encode()
+    start = -(-(len(MAGIC) + 8 + len(encoded)) // ALIGNMENT) * ALIGNMENT
+    partial = f"{path}.{os.getpid()}.tmp"
+    with open(partial, "wb") as index:
+        index.write(MAGIC + struct.pack("<Q", len(encoded)) + encoded)
+        for name, array in arrays.items():
+            index.seek(start + header["arrays"][name]["offset"])
+            index.write(array.tobytes())
+        index.truncate(start + offset)
+    os.replace(partial, path)
+
+
+def read_header(path: str) -> Tuple[Dict[str, Any], int]:
+    """
+    Return the header of an index and the offset of its first array
+    """
+    with open(path, "rb") as index:
+        if index.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a gene index")
+        size, = struct.unpack("<Q", index.read(8))
+        header = json.loads(index.read(size))
+    if header["format_version"] != FORMAT_VERSION:
+        raise ValueError(
+            f"{path} has format version {header['format_version']}, "
+            f"expected {FORMAT_VERSION}: rebuild it with gene_index.py"
+        )
+    return header, -(-(len(MAGIC) + 8 + size) // ALIGNMENT) * ALIGNMENT
+
+
+def load_index(path: str) -> Dict[str, GeneTable]:
+    """
+    Memory-map a gene index. Per-chromosome tables are read-only views
+    on the file: concurrent jobs of a node share its pages.
+    """
+    header, start = read_header(path)
+    arrays = {
+        name: np.memmap(
+            path, dtype=np.dtype(array["dtype"]), mode="r",
+            offset=start + array["offset"], shape=tuple(array["shape"])
+        )
+        for name, array in header["arrays"].items()
+    }
+    return {
+        chrom: {
+            **{
+                name: array[rows["first"]:rows["last"]]
+                for name, array in arrays.items()
+            },
+            "max_length": np.int64(rows["max_length"])
+        }
+        for chrom, rows in header["chromosomes"].items()
+    }
+
+
+def chromosome_order(chrom: str) -> Tuple[int, str]:
+    """
+    Sort chromosomes numerically, then X and Y
+    """
+    name = chrom[len("chr"):]
+    return (int(name), "") if name.isdigit() else (sys.maxsize, name)
+
+
+if __name__ == '__main__':
+    main_parser = ArgumentParser(
+        description="Build a memory-mappable gene index from the ldb mirror",
+    )
+
+    main_parser.add_argument(
+        "--ldb",
+        help="Path to ldb mirror of refGene, HGNC and COSMIC",
+        type=str,
+        required=True
+    )
+
+    main_parser.add_argument(
+        "-g", "--genome",
+        help="Genome version (default: %(default)s)",
+        choices=["hg19", "hg38"],
+        default="hg19"
+    )
+
+    main_parser.add_argument(
+        "-o", "--output",
+        help="Path to the gene index",
+        type=str,
+        required=True
+    )
+
+    args = main_parser.parse_args()
+    sources = {
+        name: {"path": path, "sha256": checksum(path)}
+        for name, path in source_paths(args.ldb, args.genome).items()
+        if os.path.exists(path)
+    }
+    tables = load_tables(args.ldb, args.genome)
+    write_index(args.output, tables, {
+        "genome": args.genome,
+        "sources": sources
+    })
+    print(f"Indexed {sum(len(t['start']) for t in tables.values())} gene "
+          f"localisations on {len(tables)} chromosomes", file=sys.stderr)
@@ -0,0 +1,129 @@
+#!/usr/bin/python3.7
+# -*- coding: utf-8 -*-
+
+"""
+This script scores the genomic instability of a whole cohort in a single
+process. The best gamma of each sample is chosen from its gammaEval.txt,
+and instability scores are computed on the L2R segments of all samples
+at once, with grouped array operations.
+"""
+
+import sys                           # System related methods
+from argparse import ArgumentParser  # Parse command line
+from pathlib import Path             # Paths related methods
+from typing import List, Tuple
+
+import numpy as np                   # Segment arrays
+import pandas as pd                  # Parse TSV files
+
+from segment_store import read_segments
+
+GOF_ALIASES = ["gof", "goodness_of_fit", "goodness.of.fit"]
+
+
+def best_gammas(files: List[Tuple[str, str]]) -> pd.DataFrame:
+    """
+    Return the row of highest goodness of fit of each (sample, gammaEval)
+    """
+    evaluations = []
+    for sample, path in files:
+        evaluation = pd.read_csv(path, sep="\t", header=0)
+        lower = {column.lower(): column for column in evaluation.columns}
+        gof = next((lower[a] for a in GOF_ALIASES if a in lower), None)
+        if gof is None or "gamma" not in lower:
+            raise ValueError(
+                f"{path} has no gamma and goodness of fit columns: "
+                f"{', '.join(evaluation.columns)}"
+            )
+        evaluation = evaluation.rename(
+            columns={gof: "GoF", lower["gamma"]: "gamma"}
+        )
+        evaluation.insert(0, "sample", sample)
+        evaluations.append(evaluation)
+
+    evaluations = pd.concat(evaluations, ignore_index=True)
+    best = evaluations.loc[
+        evaluations["GoF"].fillna(-np.inf).groupby(evaluations["sample"])
+        .idxmax()
+    ]
+    return best.set_index("sample")
+
+
+def instability_scores(segments: pd.DataFrame) -> pd.DataFrame:
+    """
+    Score every sample of a segments table: number of segments and
+    breakpoints, and fractions of the segmented genome gained, lost or
+    altered
+    """
+    segments = segments.sort_values(["sample", "chrom", "start"])
+    width = (segments["end"] - segments["start"] + 1).clip(lower=0)
+    value = segments["value"].values
+    same_chrom = (
+        (segments["sample"].values[1:] == segments["sample"].values[:-1])
+        & (segments["chrom"].values[1:] == segments["chrom"].values[:-1])
+    )
+    # A breakpoint separates two adjacent segments of different values
+    breaks = np.concatenate([
+        [False], same_chrom & (value[1:] != value[:-1])
+    ])
+    scores = pd.DataFrame({
+        "sample": segments["sample"].values,
+        "width": width.values,
+        "gained": np.where(value > 0, width.values, 0),
+        "lost": np.where(value < 0, width.values, 0),
+        "breakpoint": breaks
+    }).groupby("sample").agg(
+        segments=("width", "size"),
+        breakpoints=("breakpoint", "sum"),
+        width=("width", "sum"),
+        gained=("gained", "sum"),
+        lost=("lost", "sum")
+    )
+    total = scores.pop("width").replace(0, np.nan)
+    scores["gain_fraction"] = scores.pop("gained") / total
+    scores["loss_fraction"] = scores.pop("lost") / total
+    scores["altered_fraction"] = (
+        scores["gain_fraction"] + scores["loss_fraction"]
+    )
+    return scores
+
+
+if __name__ == '__main__':
+    main_parser = ArgumentParser(
+        description="Score the genomic instability of a cohort",
+    )
+
+    main_parser.add_argument(
+        "-m", "--manifest",
+        help="TSV file of sample, gammaEval.txt, Cut.cbs and output paths",
+        type=str,
+        required=True
+    )
+
+    main_parser.add_argument(
+        "-s", "--summary",
+        help="Path to the cohort summary (default: %(default)s)",
+        type=str,
+        default="instability/cohort_GIS.tsv"
+    )
+
+    args = main_parser.parse_args()
+    with open(args.manifest) as manifest:
+        files = [
+            line.rstrip("\n").split("\t")[:4]
+            for line in manifest if line.strip()
+        ]
+
+    gammas = best_gammas([(sample, gamma) for sample, gamma, _, _ in files])
+    segments = pd.concat(
+        [read_segments(cut, sample) for sample, _, cut, _ in files],
+        ignore_index=True
+    )
+    scores = gammas.join(instability_scores(segments), how="left")
+    scores.index.name = "sample"
+
+    Path(args.summary).parent.mkdir(parents=True, exist_ok=True)
+    scores.to_csv(args.summary, sep="\t")
+    for sample, _, _, output in files:
+        scores.loc[[sample]].to_csv(output, sep="\t")
+    print(f"Scored {len(scores)} samples", file=sys.stderr)
@@ -0,0 +1,260 @@
+#!/usr/bin/python3.7
+# -*- coding: utf-8 -*-
+
+"""
+This script renders segmentation plots of many samples with a pool of
+processes: a genome-wide L2R plot per sample and, unless plots are lazy,
+one plot per chromosome. Lazy per-chromosome plots are rendered on
+demand from the segment files with the `chromosome` command.
+"""
+
+import os                            # Paths and os functions
+import sys                           # System related methods
+from argparse import ArgumentParser  # Parse command line
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path             # Paths related methods
+from typing import Dict, List, Optional, Tuple
+
+import matplotlib                    # Plotting backend
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt      # Render figures
+import pandas as pd                  # Parse TSV files
+
+from segment_store import read_segments
+
+CHROMOSOMES = [f"chr{i}" for i in list(map(str, range(1, 23))) + ["X", "Y"]]
+COLOURS = {"gain": "#1f4e9e", "loss": "#c0281b", "neutral": "#3a3a3a"}
+
+
+def read_sample(cut: str, sample: str) -> Dict[str, pd.DataFrame]:
+    """
+    Read the cut and uncut segments of a sample, and its segmented BAF
+    when present next to them
+    """
+    directory = os.path.dirname(cut)
+    data = {}
+    for name, suffix in (("cut", "Cut.cbs"), ("nocut", "NoCut.cbs"),
+                         ("baf", "SegmentedBAF.txt")):
+        path = os.path.join(directory, f"{sample}.{suffix}")
+        if os.path.exists(path):
+            segments = read_segments(path, sample)
+            if "chrom" not in segments:
+                # Probe-level files without segment coordinates
+                continue
+            segments["chrom"] = segments["chrom"].replace(
+                {"chr23": "chrX", "chr24": "chrY"}
+            )
+            data[name] = segments
+    return data
+
+
+def baf_column(baf: pd.DataFrame) -> Optional[str]:
+    """
+    Return the name of the segmented BAF column, if any
+    """
+    columns = [
+        column for column in baf.columns
+        if "baf" in column.lower() and baf[column].dtype.kind == "f"
+    ]
+    return columns[-1] if columns else None
+
+
+def segment_colours(values: pd.Series) -> List[str]:
+    """
+    Colour segments by their status
+    """
+    return [
+        COLOURS["gain"] if value > 0 else
+        COLOURS["loss"] if value < 0 else
+        COLOURS["neutral"]
+        for value in values
+    ]
+
+
+def draw_segments(axis: plt.Axes, segments: pd.DataFrame,
+                  offset: int = 0, **kwargs) -> None:
+    """
+    Draw segments as horizontal lines at their value
+    """
+    axis.hlines(
+        segments["value"], segments["start"] + offset,
+        segments["end"] + offset, colors=segment_colours(segments["value"]),
+        **kwargs
+    )
+
+
+def plot_genome(data: Dict[str, pd.DataFrame], sample: str,
+                path: str) -> str:
+    """
+    Plot the L2R segments of all chromosomes side by side
+    """
+    cut = data["cut"]
+    figure, axis = plt.subplots(figsize=(20, 5))
+    offset, ticks = 0, []
+    for chrom in CHROMOSOMES:
+        segments = cut[cut["chrom"] == chrom]
+        if segments.empty:
+            continue
+        if "nocut" in data:
+            nocut = data["nocut"]
+            draw_segments(
+                axis, nocut[nocut["chrom"] == chrom], offset,
+                linewidth=1, alpha=0.3
+            )
+        draw_segments(axis, segments, offset, linewidth=3)
+        length = int(segments["end"].max())
+        ticks.append((offset + length / 2, chrom[len("chr"):]))
+        offset += length
+        axis.axvline(offset, color="#bbbbbb", linewidth=0.5)
+    axis.axhline(0, color="#888888", linewidth=0.5)
+    axis.set_xlim(0, max(offset, 1))
+    axis.set_xticks([tick for tick, _ in ticks])
+    axis.set_xticklabels([label for _, label in ticks])
+    axis.set_ylabel("L2R")
+    axis.set_title(f"{sample} genome-wide L2R")
+    figure.tight_layout()
+    figure.savefig(path, dpi=100)
+    plt.close(figure)
+    return path
+
+
+def plot_chromosome(data: Dict[str, pd.DataFrame], sample: str,
+                    chrom: str, path: str) -> str:
+    """
+    Plot L2R segments of a chromosome and, when available, its BAF
+    """
+    column = baf_column(data["baf"]) if "baf" in data else None
+    figure, axes = plt.subplots(
+        2 if column else 1, 1, figsize=(12, 6 if column else 4),
+        sharex=True, squeeze=False
+    )
+    l2r = axes[0][0]
+    if "nocut" in data:
+        nocut = data["nocut"]
+        draw_segments(
+            l2r, nocut[nocut["chrom"] == chrom], linewidth=1, alpha=0.3
+        )
+    cut = data["cut"]
+    draw_segments(l2r, cut[cut["chrom"] == chrom], linewidth=3)
+    l2r.axhline(0, color="#888888", linewidth=0.5)
+    l2r.set_ylabel("L2R")
+    l2r.set_title(f"{sample} {chrom}")
+    if column:
+        baf = data["baf"][data["baf"]["chrom"] == chrom]
+        axes[1][0].scatter(
+            baf["start"], baf[column], s=1, color=COLOURS["neutral"]
+        )
+        axes[1][0].set_ylim(0, 1)
+        axes[1][0].set_ylabel("BAF")
+    axes[-1][0].set_xlabel("Position")
+    figure.tight_layout()
+    figure.savefig(path, dpi=100)
+    plt.close(figure)
+    return path
+
+
+def render(sample: str, cut: str, output: str,
+           chromosomes: List[str]) -> List[str]:
+    """
+    Render the genome-wide plot of a sample, or the given chromosomes
+    """
+    data = read_sample(cut, sample)
+    directory = Path(output) / sample
+    if not chromosomes:
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{sample}.L2R.G.png"
+        return [plot_genome(data, sample, str(path))]
+
+    (directory / "chromosomes").mkdir(parents=True, exist_ok=True)
+    return [
+        plot_chromosome(
+            data, sample, chrom,
+            str(directory / "chromosomes" / f"{chrom}.png")
+        )
+        for chrom in chromosomes
+    ]
+
+
+def tasks(samples: List[Tuple[str, str]],
+          lazy: bool) -> List[Tuple[str, str, List[str]]]:
+    """
+    Split the work in one genome-wide task per sample and, unless lazy,
+    one task per sample and chromosome
+    """
+    jobs = [(sample, cut, []) for sample, cut in samples]
+    if not lazy:
+        jobs += [
+            (sample, cut, [chrom])
+            for sample, cut in samples
+            for chrom in CHROMOSOMES
+        ]
+    return jobs
+
+
+if __name__ == '__main__':
+    main_parser = ArgumentParser(
+        description="Render segmentation plots of many samples in parallel"
+    )
+    main_parser.add_argument(
+        "-o", "--output",
+        help="Output directory (default: %(default)s)",
+        type=str,
+        default="plots"
+    )
+    subparsers = main_parser.add_subparsers(dest="command", required=True)
+
+    cohort_parser = subparsers.add_parser(
+        "cohort", help="Render plots of all samples in a manifest"
+    )
+    cohort_parser.add_argument(
+        "-m", "--manifest",
+        help="TSV file of sample and Cut.cbs paths",
+        type=str,
+        required=True
+    )
+    cohort_parser.add_argument(
+        "-t", "--threads",
+        help="Number of rendering processes (default: %(default)s)",
+        type=int,
+        default=os.cpu_count()
+    )
+    cohort_parser.add_argument(
+        "--lazy",
+        help="Only render genome-wide plots",
+        action="store_true"
+    )
+
+    chromosome_parser = subparsers.add_parser(
+        "chromosome", help="Render the plot of one or more chromosomes"
+    )
+    chromosome_parser.add_argument(
+        "cut", help="Path to the sample's Cut.cbs", type=str
+    )
+    chromosome_parser.add_argument(
+        "chromosomes", help="Chromosome names", type=str, nargs="+"
+    )
+
+    args = main_parser.parse_args()
+    if args.command == "chromosome":
+        sample = Path(args.cut).name[:-len(".Cut.cbs")]
+        chromosomes = [
+            chrom if chrom.startswith("chr") else f"chr{chrom}"
+            for chrom in args.chromosomes
+        ]
+        for path in render(sample, args.cut, args.output, chromosomes):
+            print(path)
+        sys.exit(0)
+
+    with open(args.manifest) as manifest:
+        samples = [
+            tuple(line.rstrip("\n").split("\t")[:2])
+            for line in manifest if line.strip()
+        ]
+    with ProcessPoolExecutor(max_workers=args.threads) as executor:
+        futures = [
+            executor.submit(render, sample, cut, args.output, chromosomes)
+            for sample, cut, chromosomes in tasks(samples, args.lazy)
+        ]
+        for future in as_completed(futures):
+            for path in future.result():
+                print(path, file=sys.stderr)
@@ -11,27 +11,7 @@ import yaml
 
 from argparse import ArgumentParser
 from pathlib import Path
-
-
-def guess_array_type(raw_data: Path) -> str:
-    """
-    Guess array type, just like its name suggested
-    """
-    raw_data = Path(raw_data)
-    if not raw_data.exists():
-        raise FileNotFoundError(f"Could not find: {str(raw_data)}")
-
-    array_type = None
-    for file in raw_data.iterdir():
-        is_cel = file.name.endswith("CEL")
-        is_onco = file.name.endswith("C.CEL") or file.name.endswith("A.CEL")
-        if is_cel and not is_onco:
-            array_type = "CytoScanHD_Array"
-            break
-    else:
-        array_type = "OncoScan_CNV"
-
-    return array_type
+from raw_scanner import scan
 
 
 if __name__ == '__main__':
@@ -144,6 +124,151 @@ if __name__ == '__main__':
         default="na33.r2"
     )
 
+    main_parser.add_argument(
+        "--fused",
+        help="Run the whole EaCoN analysis of a sample in one R session",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--batch_size",
+        help="Number of samples processed and segmented in one R session, "
+             "0 to process each sample in its own jobs (default: %(default)s)",
+        type=int,
+        default=0
+    )
+
+    main_parser.add_argument(
+        "--stage_workers",
+        help="Number of CEL files copied concurrently from cold storage "
+             "(default: %(default)s)",
+        type=int,
+        default=4
+    )
+
+    main_parser.add_argument(
+        "--result_cache",
+        help="Path to a shared cache of EaCoN results, keyed on CEL "
+             "checksums and parameters. Empty to disable "
+             "(default: %(default)s)",
+        type=str,
+        default=""
+    )
+
+    main_parser.add_argument(
+        "--result_cache_max_gb",
+        help="Size limit of the result cache, least recently used results "
+             "are evicted first (default: %(default)s)",
+        type=float,
+        default=100
+    )
+
+    main_parser.add_argument(
+        "--resource_history",
+        help="Path to a shared history of job resources, used to predict "
+             "memory and time of new jobs. Empty to disable "
+             "(default: %(default)s)",
+        type=str,
+        default=""
+    )
+
+    main_parser.add_argument(
+        "--scheduling",
+        help="Run EaCoN steps breadth-first over the cohort, or finish "
+             "started samples depth-first (default: %(default)s)",
+        choices=["breadth", "depth"],
+        default="breadth"
+    )
+
+    main_parser.add_argument(
+        "--max_in_flight",
+        help="With depth-first scheduling, maximum number of per-sample "
+             "EaCoN jobs running at once, which bounds the samples in "
+             "progress. 0 for no limit (default: %(default)s)",
+        type=int,
+        default=0
+    )
+
+    main_parser.add_argument(
+        "--intermediate_format",
+        help="Format of processed and segmented objects handed over "
+             "between EaCoN steps: gzip RDS, uncompressed RDS (fastest, "
+             "largest), or qs archives compressed with lz4 or zstd "
+             "(default: %(default)s)",
+        choices=["rds", "uncompressed", "lz4", "zstd"],
+        default="rds"
+    )
+
+    main_parser.add_argument(
+        "--scratch_dir",
+        help="Node-local directory where EaCoN jobs run before their "
+             "outputs are moved back, e.g. '${TMPDIR}'. Empty to run "
+             "in the working directory (default: %(default)s)",
+        type=str,
+        default=""
+    )
+
+    main_parser.add_argument(
+        "--scratch_extras",
+        help="What to do with the files EaCoN writes besides declared "
+             "outputs in scratch mode: copy them back, bundle them in "
+             "one tar archive per job, or drop them (default: %(default)s)",
+        choices=["copy", "bundle", "drop"],
+        default="copy"
+    )
+
+    main_parser.add_argument(
+        "--segment_store",
+        help="Gather segments of all samples in a cohort Parquet store",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--gene_annotation",
+        help="Annotate genes of all samples in one vectorised job",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--cohort_gis",
+        help="Score instability of finished samples in one local job, "
+             "instead of one cluster job per sample",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--segment_plots",
+        help="Render segmentation plots of all samples in parallel: all "
+             "plots, or only genome-wide ones with lazy "
+             "(default: %(default)s)",
+        choices=["none", "all", "lazy"],
+        default="none"
+    )
+
+    main_parser.add_argument(
+        "--plot_threads",
+        help="Number of processes rendering segmentation plots, at most "
+             "16 (default: %(default)s)",
+        type=int,
+        default=4
+    )
+
+    main_parser.add_argument(
+        "--sweep",
+        help="Space separated list of segmentation parameters to explore, "
+             "as name=value1,value2 (e.g. ser_pen=20,40,60). Every "
+             "combination is segmented on the same normalised data",
+        type=str,
+        nargs="*",
+        default=[]
+    )
+
+    main_parser.add_argument(
+        "--recursive",
+        help="Also search CEL files in sub-directories of raw data",
+        action="store_true"
+    )
+
     args = main_parser.parse_args()
     config_params = {
         "segmenter": args.segmenter,
@@ -153,7 +278,8 @@ if __name__ == '__main__':
         "penalty": args.penalty
     }
 
-    if guess_array_type(Path(args.rawdata)) == "CytoScanHD_Array":
+    array_type = scan(args.rawdata, args.recursive)["array_type"]
+    if array_type == "CytoScanHD_Array":
         config_params.update(**{
             "arraytype": "CytoScanHD_Array",
             "smooth_k": 5,
@@ -178,6 +304,28 @@ if __name__ == '__main__':
         "threads": args.threads,
         "params": config_params,
         "design": args.design,
+        "fused": args.fused,
+        "batch_size": args.batch_size,
+        "stage_workers": args.stage_workers,
+        "result_cache": args.result_cache,
+        "result_cache_max_gb": args.result_cache_max_gb,
+        "resource_history": args.resource_history,
+        "scheduling": args.scheduling,
+        "max_in_flight": args.max_in_flight,
+        "intermediate_format": args.intermediate_format,
+        "scratch_dir": args.scratch_dir,
+        "scratch_extras": args.scratch_extras,
+        "segment_store": args.segment_store,
+        "gene_annotation": args.gene_annotation,
+        "cohort_gis": args.cohort_gis,
+        "segment_plots": args.segment_plots,
+        "plot_threads": args.plot_threads,
+        "sweep": {
+            name: [
+                yaml.safe_load(value) for value in values.split(",")
+            ]
+            for name, values in (param.split("=", 1) for param in args.sweep)
+        },
         "cold_storage": (
             args.coldstorage
             if isinstance(args.coldstorage, list)
@@ -9,76 +9,22 @@ import os                            # Paths and os funcitons
 import pandas as pd                  # Parse TSV files
 import sys                           # System related methods
 from argparse import ArgumentParser  # Parse command line
-from pathlib import Path             # Paths related methods
+from raw_scanner import scan         # Single pass raw data scanner
+from typing import Dict
 
 
-def guess_array_type(raw_data: Path) -> str:
+def build_design(samples: Dict[str, Dict[str, str]],
+                 strongr: bool = True) -> pd.DataFrame:
     """
-    Guess array type, just like its name suggested
+    Build a design file from the samples found by the raw data scanner
     """
-    raw_data = Path(raw_data)
-    if not raw_data.exists():
-        raise FileNotFoundError(f"Could not find: {str(raw_data)}")
-
-    array_type = None
-    for file in raw_data.iterdir():
-        is_cel = file.name.endswith("CEL")
-        is_onco = file.name.endswith("C.CEL") or file.name.endswith("A.CEL")
-        if is_cel and not is_onco:
-            array_type = "CytoScanHD_Array"
-            break
-    else:
-        array_type = "OncoScan_CNV"
-
-    return array_type
-
-
-def parse_cyto_dir(cytodir: str, strongr: bool = True) -> pd.DataFrame:
-    """
-    Build a design file from a cytoscan directory
-    """
-    # Path to input directory
-    cytodir = Path(cytodir)
-    print(f"Cytoscan path identified as: {str(cytodir)}", file=sys.stderr)
-    # Define column names
     sample = "Sample_id" if strongr else "SampleName"
     cel = "CEL" if strongr else "cel_files"
-    # Parse file names
-    samples = {
-        content.name: {
-            sample: str(content.stem),
-            cel: str(content.absolute())
-        }
-        for content in cytodir.iterdir()
-        if content.is_file() and content.name.endswith(".CEL")
-    }
-
-    return pd.DataFrame(samples).T
-
-
-def parse_onco_dir(oncodir: str, strongr: bool = True) -> pd.DataFrame:
-    """
-    Build a design file from a oncoscan directory
-    """
-    # Path to input directory
-    oncodir = Path(oncodir)
-    print(f"Oncoscan path identified as: {str(oncodir)}", file=sys.stderr)
-    # Define column names
-    sample = "Sample_id" if strongr else "SampleName"
-    at = "ATChannelCel"
-    cg = "GCChannelCel"
-    # Parse file names
-    samples = {
-        content.name: {
-            sample: str(content.stem)[:-2],
-            at: str(content.absolute()),
-            cg: str(content.absolute()).replace("A.CEL", "C.CEL")
-        }
-        for content in oncodir.iterdir()
-        if content.is_file() and content.name.endswith("A.CEL")
-    }
-
-    return pd.DataFrame(samples).T
+    return pd.DataFrame([
+        {sample: name, **{cel if key == "CEL" else key: path
+                          for key, path in files.items()}}
+        for name, files in samples.items()
+    ])
 
 
 if __name__ == '__main__':
@@ -110,11 +56,43 @@ if __name__ == '__main__':
         action="store_false"
     )
 
+    main_parser.add_argument(
+        "-R", "--recursive",
+        help="Also search CEL files in sub-directories",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "-w", "--workers",
+        help="Number of directories listed concurrently "
+             "(default: %(default)s)",
+        type=int,
+        default=8
+    )
+
+    main_parser.add_argument(
+        "--no-cache",
+        help="Scan raw data again even if it did not change",
+        action="store_false",
+        dest="cache"
+    )
+
+    main_parser.add_argument(
+        "--no-headers",
+        help="Rely on file names only, without reading CEL headers",
+        action="store_false",
+        dest="headers"
+    )
+
     args = main_parser.parse_args()
-    if guess_array_type(Path(args.rawdata)) == "CytoScanHD_Array":
-        data = parse_cyto_dir(str(args.rawdata), args.eacon is True)
-    else:
-        data = parse_onco_dir(str(args.rawdata), args.eacon is True)
+    raw_data = scan(
+        args.rawdata, args.recursive, args.workers, args.cache, args.headers
+    )
+    print(f"{raw_data['array_type']} path identified as: {args.rawdata}",
+          file=sys.stderr)
+    for orphan in raw_data["orphans"]:
+        print(f"Orphaned OncoScan channel ignored: {orphan}", file=sys.stderr)
+    data = build_design(raw_data["samples"], args.eacon is True)
 
     print(data.head(), file=sys.stderr)
     data.to_csv(args.design, sep="\t", index=False)
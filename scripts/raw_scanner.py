@@ -0,0 +1,296 @@
+#!/usr/bin/python3.7
+# -*- coding: utf-8 -*-
+
+"""
+This module walks a raw data directory once, and tells both the array
+type and the samples with their CEL files, read from the CEL headers.
+Scans are cached, keyed on the modification time of every scanned
+directory.
+"""
+
+import hashlib                                # Cache file names
+import json                                   # Cache serialisation
+import os                                     # Paths and os functions
+import sys                                    # System related methods
+from argparse import ArgumentParser           # Parse command line
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path                      # Paths related methods
+from typing import Any, Dict, List, Optional, Tuple
+
+from cel_header import read_headers           # CEL headers sniffing
+
+SCAN_CACHE = Path(
+    os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+) / "cel-cnv-eacon" / "scans"
+
+
+def list_dir(path: str) -> Tuple[str, int, List[str], List[str]]:
+    """
+    List CEL files and sub-directories of a directory with a single
+    system call per directory
+    """
+    cels, subdirs = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                subdirs.append(entry.path)
+            elif entry.name.endswith("CEL") and entry.is_file():
+                cels.append(os.path.abspath(entry.path))
+    return path, os.stat(path).st_mtime_ns, sorted(cels), sorted(subdirs)
+
+
+def walk(raw_data: str,
+         recursive: bool = False,
+         workers: int = 1) -> Tuple[List[str], Dict[str, int]]:
+    """
+    Return all CEL files under raw_data, and the modification time of
+    each scanned directory. Sub-directories of a same level are listed
+    concurrently.
+    """
+    cels, mtimes = [], {}
+    pending = [raw_data]
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        while pending:
+            listed = list(pool.map(list_dir, pending))
+            pending = []
+            for path, mtime, files, subdirs in listed:
+                mtimes[path] = mtime
+                cels += files
+                if recursive is True:
+                    pending += subdirs
+    return sorted(cels), mtimes
+
+
+def array_family(chip_type: Optional[str]) -> Optional[str]:
+    """
+    Return the pipeline array type of a chip type read in a CEL header
+    """
+    if chip_type is None:
+        return None
+    if chip_type.startswith("CytoScan"):
+        return "CytoScanHD_Array"
+    if chip_type.startswith("OncoScan"):
+        return "OncoScan_CNV"
+    return None
+
+
+def name_channel(name: str) -> Optional[str]:
+    """
+    Return the OncoScan channel letter suggested by a file name, if any
+    """
+    if name.endswith("A.CEL") or name.endswith("C.CEL"):
+        return name[-5]
+    return None
+
+
+def header_channel(header: Dict[str, Optional[str]]) -> Optional[str]:
+    """
+    Return the OncoScan channel letter given in a CEL header, if any
+    """
+    channel = (header.get("channel") or "").upper()
+    if "AT" in channel:
+        return "A"
+    if "GC" in channel:
+        return "C"
+    return None
+
+
+def pair_key(cel: str, header: Dict[str, Optional[str]]) -> str:
+    """
+    Return what both channels of an OncoScan array share: their barcode,
+    or their path without the A/C channel letter
+    """
+    return header.get("barcode") or cel[:-len("A.CEL")]
+
+
+def add_sample(samples: Dict[str, Dict[str, str]],
+               sample: str,
+               files: Dict[str, str]) -> None:
+    """
+    Record a sample, refusing two samples with the same name
+    """
+    if sample in samples:
+        raise ValueError(
+            f"Sample {sample} found twice: {samples[sample]} and {files}"
+        )
+    samples[sample] = files
+
+
+def guess_array_type(cels: List[str],
+                     headers: Dict[str, Dict[str, Optional[str]]]) -> str:
+    """
+    Tell the array type from CEL headers, or from file names when no
+    header could be read. Mixed array types are refused.
+    """
+    families = {
+        array_family(headers.get(cel, {}).get("chip_type")) for cel in cels
+    } - {None}
+    if len(families) > 1:
+        raise ValueError(
+            f"Raw data mixes several array types: {sorted(families)}"
+        )
+    if families:
+        return families.pop()
+    if any(name_channel(os.path.basename(cel)) is None for cel in cels):
+        return "CytoScanHD_Array"
+    return "OncoScan_CNV"
+
+
+def classify(cels: List[str],
+             headers: Optional[Dict[str, Dict[str, Optional[str]]]] = None
+             ) -> Dict[str, Any]:
+    """
+    Tell the array type of a list of CEL files, pair OncoScan channels,
+    and report orphaned channels.
+    Channels are paired on their header barcode when available, on their
+    file names otherwise.
+    """
+    headers = headers or {}
+    array_type = guess_array_type(cels, headers)
+    samples, orphans = {}, []
+    if array_type == "CytoScanHD_Array":
+        for cel in cels:
+            if cel.endswith(".CEL"):
+                add_sample(
+                    samples, os.path.basename(cel)[:-len(".CEL")], {"CEL": cel}
+                )
+    else:
+        channels = {}
+        for cel in cels:
+            header = headers.get(cel, {})
+            channel = header_channel(header) or name_channel(
+                os.path.basename(cel)
+            )
+            if channel is None:
+                orphans.append(cel)
+                continue
+            pair = pair_key(cel, header)
+            if channel in channels.setdefault(pair, {}):
+                raise ValueError(
+                    f"{cel} and {channels[pair][channel]} "
+                    "are the same channel of the same array"
+                )
+            channels[pair][channel] = cel
+        for pair in channels.values():
+            if set(pair.keys()) != {"A", "C"}:
+                orphans += pair.values()
+                continue
+            name = os.path.basename(pair["A"])
+            add_sample(
+                samples,
+                name[:-len("_A.CEL")] if name_channel(name) else name[:-4],
+                {"ATChannelCel": pair["A"], "GCChannelCel": pair["C"]}
+            )
+
+    return {
+        "array_type": array_type,
+        "samples": samples,
+        "orphans": sorted(orphans)
+    }
+
+
+def cache_path(raw_data: str, recursive: bool, headers: bool) -> Path:
+    """
+    Return the path to the cached scan of a directory
+    """
+    key = f"{os.path.realpath(raw_data)}:{recursive}:{headers}"
+    return SCAN_CACHE / f"{hashlib.sha1(key.encode()).hexdigest()}.json"
+
+
+def is_fresh(cached: Dict[str, Any]) -> bool:
+    """
+    Return true if none of the scanned directories changed since the scan
+    """
+    try:
+        return all(
+            os.stat(path).st_mtime_ns == mtime
+            for path, mtime in cached["mtimes"].items()
+        )
+    except OSError:
+        return False
+
+
+def scan(raw_data: str,
+         recursive: bool = False,
+         workers: int = 1,
+         cache: bool = True,
+         headers: bool = True) -> Dict[str, Any]:
+    """
+    Scan a raw data directory, or return its cached scan when no
+    directory changed since then. Unless headers is false, array types
+    and channels are read in the CEL headers.
+    """
+    if not os.path.isdir(raw_data):
+        raise FileNotFoundError(f"Could not find: {raw_data}")
+
+    path = cache_path(raw_data, recursive, headers)
+    if cache is True and path.exists():
+        try:
+            cached = json.loads(path.read_text())
+        except ValueError:
+            cached = None
+        if cached is not None and is_fresh(cached):
+            return cached["scan"]
+
+    cels, mtimes = walk(raw_data, recursive, workers)
+    result = classify(
+        cels, read_headers(cels, workers * 4) if headers is True else None
+    )
+    if cache is True:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_suffix(f".{os.getpid()}.tmp")
+        partial.write_text(json.dumps({"mtimes": mtimes, "scan": result}))
+        os.replace(partial, path)
+    return result
+
+
+if __name__ == '__main__':
+    main_parser = ArgumentParser(
+        description="Scan a raw data directory and print the array type, "
+                    "samples and orphaned CEL files as JSON",
+    )
+
+    main_parser.add_argument(
+        "-r", "--rawdata",
+        help="Path to raw data directory (default: %(default)s)",
+        type=str,
+        default=os.getcwd()
+    )
+
+    main_parser.add_argument(
+        "-R", "--recursive",
+        help="Also scan sub-directories",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "-w", "--workers",
+        help="Number of directories listed concurrently "
+             "(default: %(default)s)",
+        type=int,
+        default=8
+    )
+
+    main_parser.add_argument(
+        "--no-cache",
+        help="Scan again even if the directories did not change",
+        action="store_false",
+        dest="cache"
+    )
+
+    main_parser.add_argument(
+        "--no-headers",
+        help="Rely on file names only, without reading CEL headers",
+        action="store_false",
+        dest="headers"
+    )
+
+    args = main_parser.parse_args()
+    json.dump(
+        scan(
+            args.rawdata, args.recursive, args.workers, args.cache,
+            args.headers
+        ),
+        sys.stdout,
+        indent=2
+    )
@@ -0,0 +1,177 @@
+#!/usr/bin/python3.7
+# -*- coding: utf-8 -*-
+
+"""
+This module records the memory and time actually used by EaCoN jobs,
+and predicts the needs of new jobs from their array type and CEL size.
+One linear model is fitted per rule and array type.
+"""
+
+import csv                           # Parse TSV files
+import fcntl                         # Lock shared history
+import math                          # Square roots
+import os                            # Paths and os functions
+import sys                           # System related methods
+from argparse import ArgumentParser  # Parse command line
+from typing import Dict, Iterable, List, Optional, Tuple
+
+HISTORY_COLUMNS = [
+    "rule", "sample", "array_type", "cel_mb", "max_rss_mb", "time_min",
+    "source"
+]
+TARGETS = {"mem_mb": "max_rss_mb", "time_min": "time_min"}
+
+Model = Tuple[float, float, float]
+
+
+def read_history(path: str) -> List[Dict[str, str]]:
+    """
+    Read all the recorded jobs
+    """
+    if not path or not os.path.exists(path):
+        return []
+    with open(path) as history:
+        return list(csv.DictReader(history, delimiter="\t"))
+
+
+def read_benchmark(path: str) -> Optional[Tuple[float, float]]:
+    """
+    Return the peak resident memory (MB) and wall time (minutes) of a
+    Snakemake benchmark file, or None if the memory was not measured
+    """
+    with open(path) as benchmark:
+        rows = list(csv.DictReader(benchmark, delimiter="\t"))
+    try:
+        return (
+            max(float(row["max_rss"]) for row in rows),
+            max(float(row["s"]) for row in rows) / 60
+        )
+    except (KeyError, ValueError):
+        # Jobs too short to be measured report NA
+        return None
+
+
+def record(path: str,
+           benchmarks: Iterable[Tuple[str, str, str]],
+           array_type: str,
+           cel_mb: Dict[str, float]) -> int:
+    """
+    Append benchmarks of (rule, sample, benchmark path) to the history,
+    unless they already were recorded. Returns the number of new jobs.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a+") as history:
+        fcntl.flock(history.fileno(), fcntl.LOCK_EX)
+        history.seek(0)
+        known = {row["source"] for row in csv.DictReader(
+            history, delimiter="\t"
+        )}
+        writer = csv.DictWriter(
+            history, fieldnames=HISTORY_COLUMNS, delimiter="\t"
+        )
+        if history.tell() == 0:
+            writer.writeheader()
+
+        recorded = 0
+        for rule, sample, benchmark in benchmarks:
+            source = (
+                f"{os.path.realpath(benchmark)}:"
+                f"{os.stat(benchmark).st_mtime_ns}"
+            )
+            measures = read_benchmark(benchmark)
+            if source in known or measures is None or sample not in cel_mb:
+                continue
+            writer.writerow({
+                "rule": rule,
+                "sample": sample,
+                "array_type": array_type,
+                "cel_mb": f"{cel_mb[sample]:.2f}",
+                "max_rss_mb": f"{measures[0]:.2f}",
+                "time_min": f"{measures[1]:.2f}",
+                "source": source
+            })
+            recorded += 1
+        return recorded
+
+
+def fit(x: List[float], y: List[float]) -> Model:
+    """
+    Least squares fit of y = intercept + slope * x. Returns the intercept,
+    the slope and the standard deviation of residuals.
+    """
+    mean_x, mean_y = sum(x) / len(x), sum(y) / len(y)
+    var_x = sum((xi - mean_x) ** 2 for xi in x)
+    slope = 0.0 if var_x == 0 else sum(
+        (xi - mean_x) * (yi - mean_y) for xi, yi in zip(x, y)
+    ) / var_x
+    intercept = mean_y - slope * mean_x
+    residuals = [yi - intercept - slope * xi for xi, yi in zip(x, y)]
+    sd = math.sqrt(sum(r ** 2 for r in residuals) / max(len(x) - 2, 1))
+    return intercept, slope, sd
+
+
+def fit_models(history: List[Dict[str, str]],
+               min_jobs: int = 5) -> Dict[Tuple[str, str, str], Model]:
+    """
+    Fit one model per rule, array type and resource, on groups of at
+    least min_jobs recorded jobs
+    """
+    groups = {}
+    for row in history:
+        groups.setdefault((row["rule"], row["array_type"]), []).append(row)
+
+    models = {}
+    for (rule, array_type), rows in groups.items():
+        if len(rows) < min_jobs:
+            continue
+        x = [float(row["cel_mb"]) for row in rows]
+        for resource, column in TARGETS.items():
+            models[(rule, array_type, resource)] = fit(
+                x, [float(row[column]) for row in rows]
+            )
+    return models
+
+
+def predict(models: Dict[Tuple[str, str, str], Model],
+            rule: str,
+            array_type: str,
+            cel_mb: float,
+            resource: str,
+            margin: float = 2.0,
+            headroom: float = 1.1) -> Optional[float]:
+    """
+    Predict a resource with a safety margin of `margin` standard deviations
+    and `headroom` times the prediction, or return None when there is no
+    model for this rule and array type
+    """
+    model = models.get((rule, array_type, resource))
+    if model is None:
+        return None
+    intercept, slope, sd = model
+    return (max(intercept + slope * cel_mb, 0) + margin * sd) * headroom
+
+
+if __name__ == '__main__':
+    main_parser = ArgumentParser(
+        description="Print the resource models fitted on a job history",
+    )
+
+    main_parser.add_argument(
+        "history",
+        help="Path to the history of jobs",
+        type=str
+    )
+
+    main_parser.add_argument(
+        "--min-jobs",
+        help="Minimal number of jobs to fit a model (default: %(default)s)",
+        type=int,
+        default=5
+    )
+
+    args = main_parser.parse_args()
+    print("rule\tarray_type\tresource\tintercept\tslope\tsd")
+    models = fit_models(read_history(args.history), args.min_jobs)
+    for (rule, array_type, resource), model in sorted(models.items()):
+        print(rule, array_type, resource, *(f"{v:.4f}" for v in model),
+              sep="\t", file=sys.stdout)
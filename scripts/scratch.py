@@ -0,0 +1,257 @@
+#!/usr/bin/python3.7
+# -*- coding: utf-8 -*-
+
+"""
+This script lets EaCoN steps run in a node-local scratch directory. Job
+inputs are staged in, declared outputs are moved back atomically into
+the working directory, and the other files EaCoN writes are copied,
+bundled in a single archive, or dropped. Reference databases are staged
+once per node, in a cache shared by all the jobs of the node, and
+refreshed when the stamp of the mirror changes.
+"""
+
+import fcntl                         # Lock the node cache
+import hashlib                       # Node cache keys
+import json                          # Node cache signatures
+import os                            # Paths and os functions
+import shutil                        # File copies
+import tarfile                       # Bundle extra files
+import tempfile                      # Default scratch root
+import time                          # Node cache expiry
+from argparse import ArgumentParser  # Parse command line
+from pathlib import Path             # Paths related methods
+from typing import List
+
+
+def scratch_root(root: str) -> Path:
+    """
+    Expand environment variables in the scratch root, falling back on the
+    system temporary directory when they are not set
+    """
+    expanded = os.path.expandvars(root)
+    if "$" in expanded or not expanded:
+        expanded = tempfile.gettempdir()
+    return Path(expanded)
+
+
+def staged_path(path: str) -> Path:
+    """
+    Return the path of a working directory file, relative to the
+    working directory, refusing paths outside of it
+    """
+    relative = Path(os.path.normpath(path))
+    if relative.is_absolute() or relative.parts[0] == "..":
+        raise ValueError(f"{path} is not inside the working directory")
+    return relative
+
+
+def copy_path(source: Path, destination: Path) -> None:
+    """
+    Copy a file or a directory, following symbolic links
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    if source.is_dir():
+        shutil.copytree(source, destination)
+    else:
+        shutil.copyfile(source, destination)
+        shutil.copystat(source, destination)
+
+
+def replace_path(source: Path, destination: Path) -> None:
+    """
+    Copy a file or a directory next to its destination, then move it in
+    place, so readers never see a partial result
+    """
+    partial = destination.parent / f".{destination.name}.{os.getpid()}.tmp"
+    copy_path(source, partial)
+    if destination.is_dir() and not destination.is_symlink():
+        shutil.rmtree(destination)
+    os.replace(partial, destination)
+
+
+def stage(root: str, rule: str, sample: str, inputs: List[str]) -> Path:
+    """
+    Create a scratch directory for a job and copy its inputs there, at
+    the same relative paths as in the working directory
+    """
+    scratch = scratch_root(root) / f"eacon-{rule}-{sample}-{os.getpid()}"
+    scratch.mkdir(parents=True)
+    try:
+        for path in inputs:
+            copy_path(Path(path), scratch / staged_path(path))
+    except BaseException:
+        shutil.rmtree(scratch, ignore_errors=True)
+        raise
+    return scratch
+
+
+def finish(scratch: Path, rule: str, sample: str, inputs: List[str],
+           outputs: List[str], extras: str) -> None:
+    """
+    Move declared outputs back to the working directory, then handle the
+    other files written by the job, and remove the scratch directory
+    """
+    declared = {staged_path(path) for path in outputs}
+    for path in sorted(declared):
+        if (scratch / path).exists():
+            replace_path(scratch / path, path)
+
+    skipped = declared | {staged_path(path) for path in inputs}
+    others = [
+        path.relative_to(scratch) for path in sorted(scratch.rglob("*"))
+        if path.is_file()
+        and not any(
+            parent in skipped
+            for parent in [path.relative_to(scratch),
+                           *path.relative_to(scratch).parents]
+        )
+    ]
+    if others and extras == "copy":
+        for path in others:
+            replace_path(scratch / path, path)
+    elif others and extras == "bundle":
+        bundle = Path(sample) / f"{rule}_extras.tar"
+        partial = bundle.parent / f".{bundle.name}.{os.getpid()}.tmp"
+        bundle.parent.mkdir(parents=True, exist_ok=True)
+        with tarfile.open(partial, "w") as archive:
+            for path in others:
+                archive.add(scratch / path, arcname=str(path))
+        os.replace(partial, bundle)
+    shutil.rmtree(scratch, ignore_errors=True)
+
+
+def ldb_stamp(source: Path, genome: str) -> str:
+    """
+    Return a cheap signature of the ldb mirror: the content of its VERSION
+    file when there is one, the modification times of its top-level
+    entries and of the genome directory otherwise. The tree itself is
+    never walked.
+    """
+    version = source / "VERSION"
+    if version.exists():
+        return version.read_text().strip()
+    genome_dir = source / "GoldenPath" / genome
+    stamps = [
+        [entry.name, entry.stat().st_mtime_ns]
+        for entry in sorted(os.scandir(source), key=lambda e: e.name)
+    ]
+    if genome_dir.exists():
+        stamps.append([str(genome_dir), genome_dir.stat().st_mtime_ns])
+    return json.dumps(stamps)
+
+
+def node_ldb(root: str, ldb: str, genome: str) -> Path:
+    """
+    Return a node-local copy of the ldb mirror, limited to the given
+    genome. The first job of a node builds it under a lock, the other
+    jobs reuse it as long as the mirror stamp is unchanged. A new stamp
+    gets a new copy, built aside and renamed in place: copies jobs may
+    still read are never modified, and are only removed once unused for
+    a week.
+    """
+    source = Path(ldb)
+    key = hashlib.sha1(f"{source.resolve()}:{genome}".encode()).hexdigest()
+    stamp = hashlib.sha1(ldb_stamp(source, genome).encode()).hexdigest()
+    cache = scratch_root(root) / "eacon-node-cache"
+    local = cache / f"ldb-{key}-{stamp[:12]}"
+    marker = local / ".complete"
+    if marker.exists():
+        marker.touch()
+        return local
+
+    cache.mkdir(parents=True, exist_ok=True)
+    with open(cache / f"ldb-{key}.lock", "w") as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        if marker.exists():
+            return local
+        genomes = source / "GoldenPath"
+        # Partial copies left by jobs killed while holding the lock
+        for stale in cache.glob(f".ldb-{key}-*.tmp"):
+            shutil.rmtree(stale, ignore_errors=True)
+        partial = cache / f".{local.name}.{os.getpid()}.tmp"
+        for path in source.rglob("*"):
+            if path.is_file() and not (
+                path.parent != genomes and genomes in path.parents
+                and genomes / genome not in path.parents
+            ):
+                copy_path(path, partial / path.relative_to(source))
+        (partial / ".complete").touch()
+        os.replace(partial, local)
+
+        # Copies of older stamps are removed once no job used them lately
+        for old in cache.glob(f"ldb-{key}-*"):
+            used = old / ".complete"
+            if old != local and (not used.exists() or time.time()
+                                 - used.stat().st_mtime > 7 * 86400):
+                shutil.rmtree(old, ignore_errors=True)
+    return local
+
+
+if __name__ == '__main__':
+    main_parser = ArgumentParser(
+        description="Run EaCoN steps in a node-local scratch directory"
+    )
+    main_parser.add_argument(
+        "--root",
+        help="Node-local scratch root (default: %(default)s)",
+        type=str,
+        default="${TMPDIR}"
+    )
+    subparsers = main_parser.add_subparsers(dest="command", required=True)
+
+    stage_parser = subparsers.add_parser(
+        "stage", help="Stage inputs and print the scratch directory"
+    )
+    finish_parser = subparsers.add_parser(
+        "finish", help="Move outputs back and remove the scratch directory"
+    )
+    for parser in (stage_parser, finish_parser):
+        parser.add_argument(
+            "--rule", help="Name of the rule", type=str, required=True
+        )
+        parser.add_argument(
+            "--sample", help="Sample identifier", type=str, required=True
+        )
+        parser.add_argument(
+            "--inputs",
+            help="Space separated list of the job inputs",
+            type=str,
+            nargs="+",
+            required=True
+        )
+    finish_parser.add_argument(
+        "--scratch", help="Scratch directory of the job", type=str,
+        required=True
+    )
+    finish_parser.add_argument(
+        "--outputs",
+        help="Space separated list of the job outputs",
+        type=str,
+        nargs="+",
+        required=True
+    )
+    finish_parser.add_argument(
+        "--extras",
+        help="What to do with undeclared files (default: %(default)s)",
+        choices=["copy", "bundle", "drop"],
+        default="copy"
+    )
+
+    ldb_parser = subparsers.add_parser(
+        "ldb", help="Print the path to a node-local copy of ldb"
+    )
+    ldb_parser.add_argument(
+        "--ldb", help="Path to ldb mirror", type=str, required=True
+    )
+    ldb_parser.add_argument(
+        "--genome", help="Genome version", type=str, required=True
+    )
+
+    args = main_parser.parse_args()
+    if args.command == "stage":
+        print(stage(args.root, args.rule, args.sample, args.inputs))
+    elif args.command == "finish":
+        finish(Path(args.scratch), args.rule, args.sample, args.inputs,
+               args.outputs, args.extras)
+    else:
+        print(node_ldb(args.root, args.ldb, args.genome))
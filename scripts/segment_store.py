@@ -0,0 +1,442 @@
+#!/usr/bin/python3.7
+# -*- coding: utf-8 -*-
+
+"""
+This script gathers the per-sample segmentation results of a cohort in
+a compressed Parquet store, partitioned by result kind and chromosome.
+Samples are appended as they finish, without rewriting the store. In
+each part, rows are grouped by segment length and sorted by start, and
+the bounds of every row group are indexed: region queries only read the
+row groups overlapping the region.
+"""
+
+import json                          # Index and manifest
+import os                            # Paths and os functions
+import shutil                        # Remove rebuilt kinds
+import sys                           # System related methods
+from argparse import ArgumentParser  # Parse command line
+from pathlib import Path             # Paths related methods
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np                   # Segment matrices
+import pandas as pd                  # Parse TSV files
+import pyarrow as pa                 # Columnar tables
+import pyarrow.parquet as pq         # Parquet files
+
+KINDS = {
+    "Cut.cbs": "cut",
+    "NoCut.cbs": "nocut",
+    "SegmentedBAF.txt": "baf",
+    "Cut.acbs": "acbs",
+    "Instab.txt": "instability"
+}
+ALIASES = {
+    "chrom": ["chrom", "chr", "chromosome", "chrs"],
+    "start": ["start", "loc.start", "startpos"],
+    "end": ["end", "loc.end", "endpos"],
+    "value": ["log2ratio", "seg.mean", "l2r", "segment_mean"]
+}
+SAMPLES_PER_PART = 200
+ROWS_PER_GROUP = 10000
+
+
+def read_segments(path: str, sample: str) -> pd.DataFrame:
+    """
+    Read a per-sample EaCoN result file, with normalised chrom, start,
+    end and value column names and chromosome names
+    """
+    data = pd.read_csv(path, sep="\t", header=0, comment="#")
+    lower = {column.lower(): column for column in data.columns}
+    data = data.rename(columns={
+        lower[alias]: name
+        for name, aliases in ALIASES.items()
+        for alias in aliases
+        if alias in lower
+    })
+    # Sample names written by EaCoN are replaced by the design ones
+    data = data.drop(
+        columns=[c for c in ("Samplename", "ID", "sample") if c in data],
+    )
+    data.insert(0, "sample", sample)
+    if not {"chrom", "start", "end"} <= set(data.columns):
+        # Per-sample scores, such as instability, have no coordinates
+        data = data.drop(columns=["chrom"], errors="ignore")
+    else:
+        chrom = data["chrom"].astype(str)
+        data["chrom"] = np.where(
+            chrom.str.startswith("chr"), chrom, "chr" + chrom
+        )
+        data["start"] = data["start"].astype("int64")
+        data["end"] = data["end"].astype("int64")
+    for column in data.columns:
+        if data[column].dtype == object:
+            data[column] = data[column].astype(str)
+    return data
+
+
+def read_json(path: Path, default: Any) -> Any:
+    """
+    Read a json file, or return default if it does not exist
+    """
+    if not path.exists():
+        return default
+    return json.loads(path.read_text())
+
+
+def write_json(path: Path, content: Any) -> None:
+    """
+    Atomically replace a json file
+    """
+    partial = path.with_suffix(f".{os.getpid()}.tmp")
+    partial.write_text(json.dumps(content, indent=1))
+    os.replace(partial, path)
+
+
+def signature(path: str) -> List[int]:
+    """
+    Return the size and modification time of a file
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def row_groups(segments: pd.DataFrame) -> List[pd.DataFrame]:
+    """
+    Split the segments of a chromosome into row groups of segments of
+    similar lengths, sorted by start. The end of a row group is then close
+    to its last start, even when a few segments span whole arms.
+    """
+    width = (segments["end"] - segments["start"]).clip(lower=1).values
+    groups = []
+    for _, similar in segments.groupby(np.log2(width).astype(int)):
+        similar = similar.sort_values(["start", "end"])
+        groups += [
+            similar.iloc[first:first + ROWS_PER_GROUP]
+            for first in range(0, len(similar), ROWS_PER_GROUP)
+        ]
+    return groups
+
+
+def write_parts(store: Path,
+                kind: str,
+                data: pd.DataFrame,
+                part: int) -> List[Dict[str, Any]]:
+    """
+    Write one part per chromosome, and return their index entries with
+    the bounds of each row group
+    """
+    entries = []
+    groups = data.groupby("chrom") if "chrom" in data else [(None, data)]
+    for chrom, segments in groups:
+        directory = store / kind / (f"chrom={chrom}" if chrom else "")
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"part-{part:06d}.parquet"
+        chunks = row_groups(segments) if chrom else [segments]
+        schema = pa.Schema.from_pandas(segments, preserve_index=False)
+        with pq.ParquetWriter(str(path), schema,
+                              compression="zstd") as writer:
+            for chunk in chunks:
+                # One row group per chunk
+                writer.write_table(pa.Table.from_pandas(
+                    chunk, schema=schema, preserve_index=False
+                ))
+        entries.append({
+            "kind": kind,
+            "chrom": chrom,
+            "path": str(path.relative_to(store)),
+            "start": int(segments["start"].min()) if chrom else None,
+            "end": int(segments["end"].max()) if chrom else None,
+            "row_groups": [
+                [int(chunk["start"].min()), int(chunk["end"].max())]
+                for chunk in chunks
+            ] if chrom else None,
+            "rows": len(segments),
+            "samples": sorted(segments["sample"].unique().tolist())
+        })
+    return entries
+
+
+def build(store: Path,
+          files: List[Tuple[str, str, str]],
+          compact: bool = False) -> Dict[str, Any]:
+    """
+    Append new (sample, kind, path) files to the store. Kinds where an
+    already stored file changed, or all kinds when compact is true, are
+    rewritten from scratch.
+    """
+    store.mkdir(parents=True, exist_ok=True)
+    manifest = read_json(
+        store / "manifest.json", {"next_part": 0, "files": {}, "parts": []}
+    )
+    by_kind = {}
+    for sample, kind, path in files:
+        by_kind.setdefault(kind, []).append((sample, path))
+
+    for kind, kind_files in by_kind.items():
+        stored = {
+            key: value for key, value in manifest["files"].items()
+            if key.startswith(f"{kind}:")
+        }
+        changed = any(
+            stored[f"{kind}:{sample}"] != [os.path.abspath(path),
+                                           *signature(path)]
+            for sample, path in kind_files
+            if f"{kind}:{sample}" in stored
+        )
+        if changed or compact:
+            shutil.rmtree(store / kind, ignore_errors=True)
+            manifest["parts"] = [
+                part for part in manifest["parts"] if part["kind"] != kind
+            ]
+            for key in stored:
+                del manifest["files"][key]
+
+        pending = [
+            (sample, path) for sample, path in kind_files
+            if f"{kind}:{sample}" not in manifest["files"]
+        ]
+        # Bound memory usage by ingesting a few hundred samples at a time
+        for first in range(0, len(pending), SAMPLES_PER_PART):
+            chunk = pending[first:first + SAMPLES_PER_PART]
+            data = pd.concat(
+                [read_segments(path, sample) for sample, path in chunk],
+                ignore_index=True
+            )
+            manifest["parts"] += write_parts(
+                store, kind, data, manifest["next_part"]
+            )
+            manifest["next_part"] += 1
+            for sample, path in chunk:
+                manifest["files"][f"{kind}:{sample}"] = [
+                    os.path.abspath(path), *signature(path)
+                ]
+            write_json(store / "manifest.json", manifest)
+
+    write_json(store / "manifest.json", manifest)
+    return manifest
+
+
+def overlapping_parts(store: Path,
+                      kind: str,
+                      chrom: Optional[str] = None,
+                      start: Optional[int] = None,
+                      end: Optional[int] = None) -> List[Path]:
+    """
+    Return the parts of a kind that may hold segments overlapping a region
+    """
+    manifest = read_json(store / "manifest.json", {"parts": []})
+    return [
+        store / part["path"]
+        for part in overlapping_row_groups(store, kind, chrom, start, end)
+    ]
+
+
+def overlapping_row_groups(store: Path,
+                           kind: str,
+                           chrom: Optional[str] = None,
+                           start: Optional[int] = None,
+                           end: Optional[int] = None
+                           ) -> List[Dict[str, Any]]:
+    """
+    Return the index entries of the parts of a kind that may hold segments
+    overlapping a region, with the indices of their overlapping row groups
+    under "selected" (None for parts indexed without row group bounds)
+    """
+    manifest = read_json(store / "manifest.json", {"parts": []})
+    selected = []
+    for part in manifest["parts"]:
+        if (part["kind"] != kind
+                or (chrom is not None and part["chrom"] != chrom)
+                or (start is not None and part["end"] < start)
+                or (end is not None and part["start"] > end)):
+            continue
+        bounds = part.get("row_groups")
+        groups = None if bounds is None else [
+            index for index, (first, last) in enumerate(bounds)
+            if (start is None or last >= start)
+            and (end is None or first <= end)
+        ]
+        if groups != []:
+            selected.append({**part, "selected": groups})
+    return selected
+
+
+def query_region(store: Path,
+                 kind: str,
+                 chrom: str,
+                 start: int,
+                 end: int) -> pd.DataFrame:
+    """
+    Return all segments of a kind overlapping a genomic region. Only the
+    row groups whose indexed bounds overlap the region are read.
+    """
+    tables = []
+    for part in overlapping_row_groups(store, kind, chrom, start, end):
+        path = str(store / part["path"])
+        if part["selected"] is None:
+            table = pq.read_table(
+                path, filters=[("start", "<=", end), ("end", ">=", start)]
+            )
+        else:
+            table = pq.ParquetFile(path).read_row_groups(part["selected"])
+        segments = table.to_pandas()
+        tables.append(segments[
+            (segments["start"] <= end) & (segments["end"] >= start)
+        ])
+    if not tables:
+        return pd.DataFrame(columns=["sample", "chrom", "start", "end"])
+    return pd.concat(tables, ignore_index=True)
+
+
+def segment_matrix(store: Path,
+                   kind: str,
+                   chrom: str,
+                   bin_size: int,
+                   column: str = "value") -> pd.DataFrame:
+    """
+    Return a samples x bins matrix of a segment value along a chromosome,
+    averaged over each bin and weighted by segment overlap
+    """
+    segments = pd.concat(
+        [pq.read_table(str(path)).to_pandas()
+         for path in overlapping_parts(store, kind, chrom)],
+        ignore_index=True
+    )
+    samples = sorted(segments["sample"].unique())
+    bins = np.arange(0, segments["end"].max() + bin_size, bin_size)
+    rows = {sample: index for index, sample in enumerate(samples)}
+    weighted = np.zeros((len(samples), len(bins) - 1))
+    covered = np.zeros_like(weighted)
+    first_bins = segments["start"].values // bin_size
+    last_bins = segments["end"].values // bin_size
+    for row, first, last, start, end, value in zip(
+            segments["sample"].map(rows).values, first_bins, last_bins,
+            segments["start"].values, segments["end"].values,
+            segments[column].values):
+        for current in range(first, min(last, len(bins) - 2) + 1):
+            overlap = (
+                min(end, bins[current + 1]) - max(start, bins[current])
+            )
+            weighted[row, current] += overlap * value
+            covered[row, current] += overlap
+    with np.errstate(invalid="ignore", divide="ignore"):
+        matrix = weighted / covered
+    return pd.DataFrame(
+        matrix, index=samples, columns=[f"{chrom}:{b}" for b in bins[:-1]]
+    )
+
+
+def parse_region(region: str) -> Tuple[str, int, int]:
+    """
+    Parse a chr:start-end region
+    """
+    chrom, _, interval = region.replace(",", "").partition(":")
+    start, _, end = interval.partition("-")
+    chrom = chrom if chrom.startswith("chr") else f"chr{chrom}"
+    return chrom, int(start or 0), int(end or sys.maxsize)
+
+
+if __name__ == '__main__':
+    main_parser = ArgumentParser(
+        description="Build or query a cohort store of EaCoN segments"
+    )
+    main_parser.add_argument(
+        "-s", "--store",
+        help="Path to the segment store (default: %(default)s)",
+        type=str,
+        default="segment_store"
+    )
+    subparsers = main_parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser(
+        "build", help="Append new sample results to the store"
+    )
+    build_parser.add_argument(
+        "-m", "--manifest",
+        help="TSV file of sample, result file pairs",
+        type=str,
+        required=True
+    )
+    build_parser.add_argument(
+        "--compact",
+        help="Rewrite the whole store with one part per chromosome",
+        action="store_true"
+    )
+
+    region_parser = subparsers.add_parser(
+        "region", help="Print segments overlapping a region"
+    )
+    region_parser.add_argument(
+        "region", help="Region as chr:start-end", type=str
+    )
+    region_parser.add_argument(
+        "-k", "--kind",
+        help="Result kind (default: %(default)s)",
+        choices=sorted(KINDS.values()),
+        default="cut"
+    )
+    region_parser.add_argument(
+        "--below",
+        help="Only keep segments whose value is below this threshold "
+             "(e.g. -0.2 for losses)",
+        type=float,
+        default=None
+    )
+    region_parser.add_argument(
+        "--above",
+        help="Only keep segments whose value is above this threshold "
+             "(e.g. 0.2 for gains)",
+        type=float,
+        default=None
+    )
+
+    matrix_parser = subparsers.add_parser(
+        "matrix", help="Print a samples x bins matrix for a chromosome"
+    )
+    matrix_parser.add_argument(
+        "chrom", help="Chromosome name", type=str
+    )
+    matrix_parser.add_argument(
+        "-k", "--kind",
+        help="Result kind (default: %(default)s)",
+        choices=sorted(KINDS.values()),
+        default="cut"
+    )
+    matrix_parser.add_argument(
+        "-b", "--bin-size",
+        help="Bin size in bases (default: %(default)s)",
+        type=int,
+        default=1000000
+    )
+    matrix_parser.add_argument(
+        "-c", "--column",
+        help="Averaged column (default: %(default)s)",
+        type=str,
+        default="value"
+    )
+
+    args = main_parser.parse_args()
+    store = Path(args.store)
+    if args.command == "build":
+        with open(args.manifest) as manifest:
+            files = [
+                (sample, KINDS[Path(path).name[len(sample) + 1:]], path)
+                for sample, path in (
+                    line.rstrip("\n").split("\t")[:2] for line in manifest
+                    if line.strip()
+                )
+            ]
+        manifest = build(store, files, args.compact)
+        write_json(store / "index.json", manifest["parts"])
+    elif args.command == "region":
+        segments = query_region(store, args.kind, *parse_region(args.region))
+        if args.below is not None:
+            segments = segments[segments["value"] < args.below]
+        if args.above is not None:
+            segments = segments[segments["value"] > args.above]
+        segments.to_csv(sys.stdout, sep="\t", index=False)
+    else:
+        chrom, _, _ = parse_region(args.chrom)
+        segment_matrix(
+            store, args.kind, chrom, args.bin_size, args.column
+        ).to_csv(sys.stdout, sep="\t")
@@ -0,0 +1,316 @@
+#!/usr/bin/python3.7
+# -*- coding: utf-8 -*-
+
+"""
+This script stages CEL files from cold storage to the working directory:
+files are copied concurrently, verified and skipped when already present.
+Files outside of the given cold storage mount points are linked rather
+than copied.
+"""
+
+import fcntl                                  # Reflinks
+import hashlib                                # Checksums
+import os                                     # Low level copies
+import shutil                                 # File metadata
+import sys                                    # System related methods
+from argparse import ArgumentParser           # Parse command line
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path                      # Paths related methods
+from typing import Dict, List, Optional, Tuple
+
+CHUNK = 8 * 1024 * 1024
+FICLONE = 0x40049409
+
+
+def read_manifest(path: Path) -> List[Tuple[str, str]]:
+    """
+    Read a two-columns TSV file of source and destination paths
+    """
+    with Path(path).open() as manifest:
+        return [
+            tuple(line.rstrip("\n").split("\t")[:2])
+            for line in manifest
+            if line.strip() and not line.startswith("#")
+        ]
+
+
+def previous_digests(path: Path) -> Dict[str, str]:
+    """
+    Return the checksums recorded by a previous staging report
+    """
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with path.open() as report:
+        header = report.readline().rstrip("\n").split("\t")
+        return {
+            row["destination"]: row["md5"]
+            for row in (
+                dict(zip(header, line.rstrip("\n").split("\t")))
+                for line in report
+            )
+        }
+
+
+def file_digest(path: str) -> str:
+    """
+    Return the md5 checksum of a file, read by large chunks
+    """
+    digest = hashlib.md5()
+    with open(path, "rb") as stream:
+        for chunk in iter(lambda: stream.read(CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_cold(path: str, cold_storage: List[str]) -> bool:
+    """
+    Return true if a path lies on one of the cold storage mount points
+    """
+    path = os.path.realpath(path)
+    return any(
+        os.path.commonpath([path, os.path.realpath(mount)])
+        == os.path.realpath(mount)
+        for mount in cold_storage
+    )
+
+
+def choose_strategy(source: str,
+                    destination: str,
+                    cold_storage: List[str]) -> str:
+    """
+    Pick the cheapest safe way to make source available at destination:
+    cold storage is always copied, files on the working directory file
+    system are cloned or hard-linked, other hot files are symlinked.
+    Without any cold storage mount point, no file is known to be on hot
+    storage, and all of them are copied.
+    """
+    if not cold_storage or is_cold(source, cold_storage):
+        return "copy"
+    target_dir = os.path.dirname(os.path.abspath(destination))
+    if os.stat(source).st_dev == os.stat(target_dir).st_dev:
+        return "reflink"
+    return "symlink"
+
+
+def is_staged(source: os.stat_result, destination: str) -> bool:
+    """
+    Return true if destination already is an identical copy of source
+    """
+    try:
+        staged = os.stat(destination)
+    except FileNotFoundError:
+        return False
+    if (staged.st_dev, staged.st_ino) == (source.st_dev, source.st_ino):
+        return True
+    return (
+        staged.st_size == source.st_size
+        and staged.st_mtime_ns == source.st_mtime_ns
+    )
+
+
+def link(source: str, destination: str, strategy: str) -> str:
+    """
+    Make source available at destination without copying its content.
+    Falls back on the next cheapest strategy, and returns the one used.
+    """
+    partial = f"{destination}.part"
+    if os.path.lexists(partial):
+        os.remove(partial)
+    if strategy == "reflink":
+        try:
+            with open(source, "rb") as src, open(partial, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            shutil.copystat(source, partial)
+            os.replace(partial, destination)
+            return "reflink"
+        except OSError:
+            os.remove(partial)
+            strategy = "hardlink"
+    if strategy == "hardlink":
+        try:
+            os.link(source, partial)
+            os.replace(partial, destination)
+            return "hardlink"
+        except OSError:
+            strategy = "symlink"
+    os.symlink(os.path.realpath(source), partial)
+    os.replace(partial, destination)
+    return "symlink"
+
+
+def copy_kernel(source: str, destination: str, size: int) -> None:
+    """
+    Copy a file without going through user space when the kernel allows it
+    """
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        copied = 0
+        try:
+            while copied < size:
+                if hasattr(os, "copy_file_range"):
+                    sent = os.copy_file_range(src.fileno(), dst.fileno(), CHUNK)
+                else:
+                    sent = os.sendfile(dst.fileno(), src.fileno(), None, CHUNK)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError:
+            # Not supported between these file systems: plain copy
+            src.seek(copied)
+            dst.seek(copied)
+            shutil.copyfileobj(src, dst, CHUNK)
+
+
+def copy_hashed(source: str, destination: str) -> str:
+    """
+    Copy a file by large sequential reads, returning its md5 checksum
+    """
+    digest = hashlib.md5()
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        for chunk in iter(lambda: src.read(CHUNK), b""):
+            digest.update(chunk)
+            dst.write(chunk)
+    return digest.hexdigest()
+
+
+def stage(source: str,
+          destination: str,
+          checksum: bool = True,
+          known_digest: Optional[str] = None,
+          cold_storage: Optional[List[str]] = None) -> Dict[str, str]:
+    """
+    Copy or link source to destination unless it is already there,
+    then verify copies
+    """
+    stat = os.stat(source)
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    strategy = choose_strategy(source, destination, cold_storage or [])
+    result = {
+        "source": source,
+        "destination": destination,
+        "size": str(stat.st_size),
+        "md5": known_digest or "-",
+        "strategy": strategy,
+        "action": "skipped"
+    }
+    if is_staged(stat, destination):
+        return result
+
+    if strategy != "copy":
+        result["strategy"] = link(source, destination, strategy)
+        result["md5"] = "-"
+        result["action"] = "linked"
+        return result
+
+    # Never leave a truncated file under the final name
+    partial = f"{destination}.part"
+    if checksum is True:
+        expected = copy_hashed(source, partial)
+        observed = file_digest(partial)
+        if observed != expected:
+            os.remove(partial)
+            raise IOError(f"Checksum mismatch while staging {source}")
+        result["md5"] = observed
+    else:
+        copy_kernel(source, partial, stat.st_size)
+        result["md5"] = "-"
+
+    if os.stat(partial).st_size != stat.st_size:
+        os.remove(partial)
+        raise IOError(f"Size mismatch while staging {source}")
+
+    shutil.copystat(source, partial)
+    os.replace(partial, destination)
+    result["action"] = "copied"
+    return result
+
+
+def stage_all(transfers: List[Tuple[str, str]],
+              workers: int = 4,
+              checksum: bool = True,
+              digests: Optional[Dict[str, str]] = None,
+              cold_storage: Optional[List[str]] = None
+              ) -> List[Dict[str, str]]:
+    """
+    Stage all files with a bounded pool of concurrent workers
+    """
+    digests = digests or {}
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        jobs = [
+            pool.submit(
+                stage, src, dest, checksum, digests.get(dest), cold_storage
+            )
+            for src, dest in transfers
+        ]
+        return [job.result() for job in jobs]
+
+
+def write_report(results: List[Dict[str, str]], path: Path) -> None:
+    """
+    Save what was done for each file in a TSV file
+    """
+    columns = ["source", "destination", "size", "md5", "strategy", "action"]
+    with Path(path).open("w") as report:
+        report.write("\t".join(columns) + "\n")
+        for result in results:
+            report.write("\t".join(result[col] for col in columns) + "\n")
+
+
+if __name__ == '__main__':
+    main_parser = ArgumentParser(
+        description="Stage CEL files from cold storage to the working "
+                    "directory",
+        epilog="Files already staged with the same size and modification "
+               "time are neither copied nor linked again."
+    )
+
+    main_parser.add_argument(
+        "-m", "--manifest",
+        help="TSV file with source and destination paths",
+        type=str,
+        required=True
+    )
+
+    main_parser.add_argument(
+        "-o", "--output",
+        help="Path to the staging report (default: %(default)s)",
+        type=str,
+        default="raw_data/manifest.tsv"
+    )
+
+    main_parser.add_argument(
+        "-w", "--workers",
+        help="Number of concurrent copies (default: %(default)s)",
+        type=int,
+        default=4
+    )
+
+    main_parser.add_argument(
+        "--no-checksum",
+        help="Only check file sizes, allowing kernel-side copies",
+        action="store_false",
+        dest="checksum"
+    )
+
+    main_parser.add_argument(
+        "-c", "--cold-storage",
+        help="Space separated list of cold storage mount points. When not "
+             "empty, only files on these mount points are copied, other "
+             "ones are linked",
+        type=str,
+        nargs="*",
+        default=None
+    )
+
+    args = main_parser.parse_args()
+    results = stage_all(
+        read_manifest(args.manifest),
+        workers=args.workers,
+        checksum=args.checksum,
+        digests=previous_digests(args.output),
+        cold_storage=args.cold_storage
+    )
+    for action in ("copied", "linked", "skipped"):
+        count = sum(result["action"] == action for result in results)
+        print(f"{count} file(s) {action}", file=sys.stderr)
+    write_report(results, args.output)
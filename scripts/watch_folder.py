@@ -0,0 +1,470 @@
+#!/usr/bin/python3.7
+# -*- coding: utf-8 -*-
+
+"""
+This script watches a raw data directory while arrays come off the
+scanner. CEL files are taken once they stopped growing, OncoScan
+channels once both of them arrived. New samples are appended to the
+design, and Snakemake is run on their targets only, by micro-batches,
+one run at a time. Directory changes are caught with inotify, or by
+polling on network filesystems where inotify misses remote writes.
+"""
+
+import ctypes                        # inotify system calls
+import ctypes.util                   # Find the C library
+import os                            # Paths and os functions
+import select                        # Wait for inotify events
+import shlex                         # Print commands
+import signal                        # Graceful stop
+import struct                        # Parse inotify events
+import subprocess                    # Run Snakemake
+import sys                           # System related methods
+import time                          # Settling and batching delays
+from argparse import ArgumentParser, REMAINDER
+from pathlib import Path             # Paths related methods
+from typing import Dict, List, Optional, Set, Tuple
+
+import yaml                          # Read the configuration file
+
+from cel_header import read_header   # CEL headers sniffing
+from prepare_design import build_design
+from raw_scanner import (array_family, classify, guess_array_type,
+                         pair_key, walk)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+EVENT = struct.Struct("iIII")
+NETWORK_FILESYSTEMS = {
+    "nfs", "nfs4", "cifs", "smb3", "beegfs", "lustre", "gpfs", "fuse.sshfs"
+}
+
+
+class Inotify:
+    """
+    Minimal inotify watcher on a set of directories, through the C library
+    """
+
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+        )
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                   ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watched = set()
+
+    def watch(self, directories: List[str]) -> None:
+        """
+        Watch new directories, ignoring the ones already watched
+        """
+        for directory in set(directories) - self.watched:
+            if self.add_watch(self.fd, os.fsencode(directory),
+                              WATCH_MASK) < 0:
+                # Polling timeouts still cover this directory
+                print(f"Could not watch {directory}: "
+                      f"{os.strerror(ctypes.get_errno())}", file=sys.stderr)
+            self.watched.add(directory)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait for events at most timeout seconds, and drain them. Returns
+        true if something changed.
+        """
+        ready, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        changed = False
+        while ready:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size + length
+                changed = True
+        return changed
+
+
+def filesystem_type(path: str) -> Optional[str]:
+    """
+    Return the type of the filesystem holding a path, from /proc/mounts
+    """
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    try:
+        with open("/proc/mounts") as mounts:
+            for line in mounts:
+                fields = line.split()
+                mount_point = fields[1].replace("\\040", " ")
+                if (path == mount_point
+                        or path.startswith(mount_point.rstrip("/") + "/")):
+                    if len(mount_point) > len(best):
+                        best, fstype = mount_point, fields[2]
+    except OSError:
+        return None
+    return fstype
+
+
+def settled(cels: List[str],
+            seen: Dict[str, Tuple[int, int, float]],
+            settle: float) -> List[str]:
+    """
+    Return CEL files whose size and modification time did not change for
+    settle seconds, and whose header can be read
+    """
+    now = time.time()
+    complete = []
+    for cel in cels:
+        try:
+            stat = os.stat(cel)
+        except OSError:
+            continue
+        previous = seen.get(cel)
+        if previous is None or previous[:2] != (stat.st_size,
+                                                stat.st_mtime_ns):
+            seen[cel] = (stat.st_size, stat.st_mtime_ns, now)
+            continue
+        if now - previous[2] >= settle:
+            complete.append(cel)
+    for cel in set(seen) - set(cels):
+        del seen[cel]
+    return complete
+
+
+def report_once(message: str, reported: Set[str]) -> None:
+    """
+    Print a problem the first time it is met
+    """
+    if message not in reported:
+        reported.add(message)
+        print(message, file=sys.stderr)
+
+
+def classify_each(cels: List[str],
+                  headers: Dict[str, Dict[str, Optional[str]]],
+                  array_type: Optional[str],
+                  reported: Set[str]
+                  ) -> Tuple[Dict[str, Dict[str, str]], Optional[str]]:
+    """
+    Pair and name samples one array at a time, so that a mispaired,
+    duplicated or foreign array only holds back its own files. The array
+    type is guessed once, then files of other array types are left out.
+    """
+    if not cels:
+        return {}, array_type
+    if array_type is None:
+        try:
+            array_type = guess_array_type(cels, headers)
+        except ValueError as error:
+            report_once(f"Waiting for raw data to be fixed: {error}",
+                        reported)
+            return {}, None
+
+    groups = {}
+    for cel in cels:
+        header = headers.get(cel, {})
+        if array_family(header.get("chip_type")) not in (None, array_type):
+            report_once(f"Ignoring {cel}: not a {array_type} array",
+                        reported)
+            continue
+        key = cel if array_type == "CytoScanHD_Array" \
+            else pair_key(cel, header)
+        groups.setdefault(key, []).append(cel)
+
+    samples = {}
+    for group in groups.values():
+        try:
+            found = classify(group, headers)
+        except ValueError as error:
+            report_once(f"Ignoring {', '.join(group)}: {error}", reported)
+            continue
+        if found["array_type"] != array_type:
+            continue
+        for sample, files in found["samples"].items():
+            if sample in samples:
+                report_once(
+                    f"Ignoring {files}: sample {sample} found twice",
+                    reported
+                )
+                continue
+            samples[sample] = files
+    return samples, array_type
+
+
+def design_samples(design: Path) -> Set[str]:
+    """
+    Return the samples already in the design
+    """
+    if not design.exists():
+        return set()
+    with design.open() as design_file:
+        lines = design_file.read().splitlines()
+    return {line.split("\t")[0] for line in lines[1:] if line.strip()}
+
+
+def append_design(design: Path, samples: Dict[str, Dict[str, str]]) -> None:
+    """
+    Atomically rewrite the design with new samples at its end
+    """
+    new = build_design(samples).to_csv(sep="\t", index=False)
+    if design.exists():
+        content = design.read_text().rstrip("\n") + "\n"
+        new = content + new.split("\n", 1)[1]
+    partial = design.with_suffix(f".{os.getpid()}.tmp")
+    partial.write_text(new)
+    os.replace(partial, design)
+
+
+def sample_targets(sample: str, config: Dict) -> List[str]:
+    """
+    Return the final outputs of a sample, leaving cohort-wide outputs
+    to a regular run
+    """
+    segmenter = config["params"]["segmenter"]
+    targets = [
+        os.sep.join([sample, segmenter, "ASCN", f"{sample}.gammaEval.png"]),
+        os.sep.join([sample, segmenter, "L2R", f"{sample}.REPORT.html"])
+    ]
+    if config.get("cohort_gis", False) is not True:
+        targets.append(f"{sample}/{sample}_GIS_from_best_gamma.txt")
+    if config.get("gene_annotation", False) is True:
+        targets += [
+            f"annotation/{sample}.{genes}.txt"
+            for genes in ("TargetGenes", "TruncatedGenes")
+        ]
+    if config.get("segment_plots", "none") != "none":
+        targets.append(f"plots/{sample}/{sample}.L2R.G.png")
+    return targets
+
+
+if __name__ == '__main__':
+    main_parser = ArgumentParser(
+        description="Process CEL files as they land in a raw data directory",
+        epilog="Everything after -- is the Snakemake command line, to "
+               "which the targets of new samples are appended."
+    )
+
+    main_parser.add_argument(
+        "-r", "--rawdata",
+        help="Path to the watched raw data directory (default: %(default)s)",
+        type=str,
+        default=os.getcwd()
+    )
+
+    main_parser.add_argument(
+        "-d", "--design",
+        help="Path to the design file, new samples are appended to it "
+             "(default: %(default)s)",
+        type=str,
+        default="design.tsv"
+    )
+
+    main_parser.add_argument(
+        "-c", "--configfile",
+        help="Path to the configuration file (default: %(default)s)",
+        type=str,
+        default="config.yaml"
+    )
+
+    main_parser.add_argument(
+        "--prepare",
+        help="Command creating the configuration file, run before the "
+             "first Snakemake run when it does not exist",
+        type=str,
+        default=None
+    )
+
+    main_parser.add_argument(
+        "-R", "--recursive",
+        help="Also watch sub-directories",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--settle",
+        help="Seconds a CEL file must stop growing before it is taken "
+             "(default: %(default)s)",
+        type=float,
+        default=60
+    )
+
+    main_parser.add_argument(
+        "--batch",
+        help="Number of new samples triggering a run (default: %(default)s)",
+        type=int,
+        default=4
+    )
+
+    main_parser.add_argument(
+        "--max-wait",
+        help="Seconds after which fewer new samples still trigger a run "
+             "(default: %(default)s)",
+        type=float,
+        default=300
+    )
+
+    main_parser.add_argument(
+        "--retries",
+        help="Number of times samples of a failed run are run again "
+             "(default: %(default)s)",
+        type=int,
+        default=2
+    )
+
+    main_parser.add_argument(
+        "--retry-delay",
+        help="Seconds before the first retry, doubled on each retry "
+             "(default: %(default)s)",
+        type=float,
+        default=600
+    )
+
+    main_parser.add_argument(
+        "--poll",
+        help="Seconds between two scans when polling, or between two "
+             "safety scans with inotify (default: %(default)s)",
+        type=float,
+        default=30
+    )
+
+    main_parser.add_argument(
+        "--force-poll",
+        help="Poll even if inotify is available",
+        action="store_true"
+    )
+
+    main_parser.add_argument(
+        "--idle-exit",
+        help="Exit after this many seconds without new sample nor "
+             "running job, 0 to watch forever (default: %(default)s)",
+        type=float,
+        default=0
+    )
+
+    main_parser.add_argument(
+        "snakemake",
+        help="Snakemake command line, after --",
+        nargs=REMAINDER
+    )
+
+    args = main_parser.parse_args()
+    snakemake = [arg for arg in args.snakemake if arg != "--"]
+    if not snakemake:
+        main_parser.error("a Snakemake command line is required after --")
+
+    design = Path(args.design)
+    fstype = filesystem_type(args.rawdata)
+    inotify = None
+    if not args.force_poll and fstype not in NETWORK_FILESYSTEMS:
+        try:
+            inotify = Inotify()
+        except (OSError, AttributeError) as error:
+            print(f"inotify unavailable ({error}), polling", file=sys.stderr)
+    print(f"Watching {args.rawdata} ({fstype}) with "
+          f"{'inotify' if inotify else 'polling'}", file=sys.stderr)
+
+    stopping = []
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.append(True))
+
+    seen, headers, reported = {}, {}, set()
+    array_type = None
+    known = design_samples(design)
+    pending, pending_since = [], None
+    run, running = None, []
+    attempts, retries = {}, {}
+    last_activity = time.time()
+    while True:
+        cels, mtimes = walk(args.rawdata, args.recursive)
+        if inotify is not None:
+            inotify.watch(list(mtimes))
+
+        complete = settled(cels, seen, args.settle)
+        for cel in complete:
+            # Headers are only read once a file is complete
+            key = (cel, seen[cel][0], seen[cel][1])
+            if key not in headers:
+                headers[key] = read_header(cel)
+        found, array_type = classify_each(complete, {
+            cel: headers[(cel, seen[cel][0], seen[cel][1])]
+            for cel in complete
+        }, array_type, reported)
+
+        new = {
+            sample: files for sample, files in found.items()
+            if sample not in known
+        }
+        if new:
+            append_design(design, new)
+            known |= set(new)
+            pending += sorted(new)
+            pending_since = pending_since or time.time()
+            last_activity = time.time()
+            print(f"New sample(s) in {design}: {', '.join(sorted(new))}",
+                  file=sys.stderr)
+
+        if run is not None and run.poll() is not None:
+            print(f"Snakemake exited with status {run.returncode} for: "
+                  f"{', '.join(running)}", file=sys.stderr)
+            # Samples of a failed run are run again later, with a backoff
+            for sample in running if run.returncode != 0 else []:
+                attempts[sample] = attempts.get(sample, 0) + 1
+                if attempts[sample] > args.retries:
+                    print(f"Giving up on {sample} after "
+                          f"{attempts[sample]} runs", file=sys.stderr)
+                    continue
+                retries[sample] = time.time() + args.retry_delay * 2 ** (
+                    attempts[sample] - 1
+                )
+            run, running = None, []
+            last_activity = time.time()
+
+        for sample, retry_at in list(retries.items()):
+            if time.time() >= retry_at:
+                del retries[sample]
+                pending.append(sample)
+                pending_since = pending_since or time.time()
+
+        # One Snakemake run at a time, as runs lock the working directory
+        due = pending and (
+            len(pending) >= args.batch
+            or time.time() - pending_since >= args.max_wait
+        )
+        if run is None and due and not stopping:
+            if not Path(args.configfile).exists() and args.prepare:
+                subprocess.run(args.prepare, shell=True, check=True)
+            with open(args.configfile) as config_file:
+                config = yaml.safe_load(config_file)
+            running, pending, pending_since = pending, [], None
+            command = snakemake + [
+                target for sample in running
+                for target in sample_targets(sample, config)
+            ]
+            print(f"Running: {' '.join(map(shlex.quote, command))}",
+                  file=sys.stderr)
+            run = subprocess.Popen(command)
+
+        if stopping:
+            if run is not None:
+                print("Waiting for the running Snakemake to finish",
+                      file=sys.stderr)
+                run.wait()
+            break
+        if (args.idle_exit > 0 and run is None and not pending
+                and not retries
+                and time.time() - last_activity >= args.idle_exit):
+            break
+
+        # Files still settling are checked again soon
+        timeout = min(args.poll, args.settle) if len(complete) < len(cels) \
+            else args.poll
+        if inotify is not None:
+            inotify.wait(timeout)
+        else:
+            time.sleep(timeout)